@@ -0,0 +1,188 @@
+"""
+Build a GPT-2 tokenized, memory-mappable training corpus from filtered documents.
+
+Documents are read from `.txt` files (one document per file, optionally
+gzipped, as written by `cs336_data.generate_data`) and `.jsonl` files (one
+document per line in a `text` field, optionally gzipped). Worker processes
+tokenize groups of files and stream the tokens into their own uint16 shard,
+with the end-of-text token after every document. The shards are then
+concatenated, in input order, into one `.bin` file next to an offsets index:
+document i is `tokens[offsets[i] : offsets[i + 1]]` (including its separator).
+No step holds more than one group of documents in memory.
+"""
+
+from __future__ import annotations
+
+import functools
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+logger = logging.getLogger(__name__)
+
+TOKEN_DTYPE = np.uint16
+
+
+def offsets_path(bin_path: str | os.PathLike) -> Path:
+    """Path of the document offsets index that belongs to a `.bin` file."""
+    return Path(bin_path).with_suffix(".offsets.npy")
+
+
+@functools.cache
+def _get_encoding(encoding_name: str):
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def iter_input_files(paths: Iterable[str | os.PathLike]) -> list[Path]:
+    """Expand directories into the supported document files they contain, in sorted order."""
+    files = []
+    for path in map(Path, paths):
+        candidates = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        files.extend(p for p in candidates if _is_document_file(p))
+    return files
+
+
+def _is_document_file(path: Path) -> bool:
+    name = path.name.removesuffix(".gz")
+    return name.endswith(".txt") or name.endswith(".jsonl")
+
+
+def iter_documents(path: str | os.PathLike, text_field: str = "text") -> Iterator[str]:
+    """Documents stored in one input file."""
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        if path.name.removesuffix(".gz").endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)[text_field]
+        else:
+            yield f.read()
+
+
+def tokenize_files(
+    paths: list[Path],
+    shard_path: Path,
+    encoding_name: str = "gpt2",
+    text_field: str = "text",
+    batch_size: int = 64,
+) -> tuple[Path, npt.NDArray[np.int64]]:
+    """Tokenize the documents of `paths` into a uint16 shard.
+
+    Args:
+        paths: input files, tokenized in order.
+        shard_path: where to write the raw uint16 tokens.
+        encoding_name: tiktoken encoding; every document is followed by its end-of-text token.
+        text_field: field holding the text in `.jsonl` inputs.
+        batch_size: documents encoded per call to the tokenizer (bounds the memory of a worker).
+
+    Returns:
+        The shard path and the number of tokens of every document.
+    """
+    encoding = _get_encoding(encoding_name)
+    eot = encoding.eot_token
+    lengths = []
+
+    def flush(batch: list[str], out):
+        for tokens in encoding.encode_ordinary_batch(batch, num_threads=1):
+            tokens.append(eot)
+            array = np.asarray(tokens)
+            if array.max(initial=0) > np.iinfo(TOKEN_DTYPE).max:
+                raise ValueError(f"token ids of {encoding_name} do not fit in {TOKEN_DTYPE.__name__}")
+            out.write(array.astype(TOKEN_DTYPE).tobytes())
+            lengths.append(len(tokens))
+
+    with open(shard_path, "wb") as out:
+        batch = []
+        for path in paths:
+            for text in iter_documents(path, text_field):
+                batch.append(text)
+                if len(batch) >= batch_size:
+                    flush(batch, out)
+                    batch = []
+        if batch:
+            flush(batch, out)
+    return shard_path, np.array(lengths, dtype=np.int64)
+
+
+def build_tokenized_corpus(
+    inputs: Iterable[str | os.PathLike],
+    output_path: str | os.PathLike,
+    num_workers: int | None = None,
+    files_per_task: int = 256,
+    encoding_name: str = "gpt2",
+    text_field: str = "text",
+    shard_dir: str | os.PathLike | None = None,
+) -> tuple[int, int]:
+    """Tokenize every document of `inputs` into `output_path` and its offsets index.
+
+    Args:
+        inputs: files or directories of `.txt` / `.jsonl` documents (optionally gzipped).
+        output_path: the uint16 `.bin` to write; the offsets go to `offsets_path(output_path)`.
+        num_workers: tokenizer processes (default: all cores).
+        files_per_task: input files per worker task, i.e. per shard.
+        encoding_name: tiktoken encoding, GPT-2 by default.
+        text_field: field holding the text in `.jsonl` inputs.
+        shard_dir: where the per-task shards are staged (default: a temporary directory next to the output).
+
+    Returns:
+        The number of documents and the number of tokens written.
+    """
+    files = iter_input_files(inputs)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    num_workers = num_workers or os.cpu_count() or 1
+    tasks = [files[i : i + files_per_task] for i in range(0, len(files), files_per_task)]
+    logger.info(f"tokenizing {len(files)} files in {len(tasks)} tasks with {num_workers} workers")
+
+    with tempfile.TemporaryDirectory(dir=shard_dir or output_path.parent) as tmp:
+        shards: dict[int, tuple[Path, npt.NDArray[np.int64]]] = {}
+        with ProcessPoolExecutor(num_workers) as executor:
+            # keep at most two tasks per worker in flight, the shards themselves live on disk
+            pending = {}
+            for task_id, paths in enumerate(tasks):
+                future = executor.submit(
+                    tokenize_files, paths, Path(tmp) / f"shard_{task_id:06d}.bin", encoding_name, text_field
+                )
+                pending[future] = task_id
+                while len(pending) >= 2 * num_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        shards[pending.pop(future)] = future.result()
+            for future in wait(pending).done:
+                shards[pending.pop(future)] = future.result()
+
+        # concatenate in task order so that the output does not depend on scheduling
+        lengths = [np.zeros(1, dtype=np.int64)]
+        with open(output_path, "wb") as out:
+            for task_id in range(len(tasks)):
+                shard_path, shard_lengths = shards.pop(task_id)
+                with open(shard_path, "rb") as shard:
+                    shutil.copyfileobj(shard, out, 16 << 20)
+                shard_path.unlink()
+                lengths.append(shard_lengths)
+    offsets = np.cumsum(np.concatenate(lengths))
+    np.save(offsets_path(output_path), offsets)
+    logger.info(f"wrote {len(offsets) - 1} documents, {offsets[-1]} tokens to {output_path}")
+    return len(offsets) - 1, int(offsets[-1])
+
+
+def load_tokenized_corpus(
+    bin_path: str | os.PathLike,
+) -> tuple[npt.NDArray[np.uint16], npt.NDArray[np.int64] | None]:
+    """Memory-map a `.bin` corpus and its offsets index (None if the corpus has no index)."""
+    tokens = np.memmap(bin_path, dtype=TOKEN_DTYPE, mode="r")
+    index = offsets_path(bin_path)
+    offsets = np.load(index, mmap_mode="r") if index.exists() else None
+    return tokens, offsets
@@ -1,28 +1,357 @@
 from __future__ import annotations
 
+import collections
+import queue
+import threading
+
 import numpy as np
 import numpy.typing as npt
 import torch
 
 
+def _gather_windows(dataset: npt.NDArray, starting_idxs: npt.NDArray, width: int, out: npt.NDArray | None = None):
+    """dataset[i : i + width] for every starting index, with a single fancy-indexing gather"""
+    windows = dataset[starting_idxs[:, None] + np.arange(width)]
+    if out is None:
+        return windows.astype(np.int64)
+    out[...] = windows
+    return out
+
+
 def get_batch(
     dataset: npt.NDArray, batch_size: int, context_length: int, device: str
 ) -> tuple[torch.Tensor, torch.Tensor]:
     starting_idxs = torch.randint(len(dataset) - context_length, (batch_size,))
-    x = torch.stack([
-            torch.from_numpy((dataset[i : i + context_length]).astype(np.int64))
-            for i in starting_idxs
-    ])  # fmt: skip
-    y = torch.stack(
-        [
-            torch.from_numpy((dataset[i + 1 : i + 1 + context_length]).astype(np.int64))
-            for i in starting_idxs
-        ]
-    )  # fmt: skip
+    tokens = torch.from_numpy(_gather_windows(dataset, starting_idxs.numpy(), context_length + 1))
     if "cuda" in device:
-        x = x.pin_memory().to(device, non_blocking=True)
-        y = y.pin_memory().to(device, non_blocking=True)
+        tokens = tokens.pin_memory().to(device, non_blocking=True)
     else:
-        x = x.to(device)
-        y = y.to(device)
-    return x, y
+        tokens = tokens.to(device)
+    return tokens[:, :-1].contiguous(), tokens[:, 1:].contiguous()
+
+
+def packed_document_positions(x: torch.Tensor, eos_token_id: int) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Document ids and document-relative positions of packed input sequences.
+
+    A window of the token stream spans several documents separated by `eos_token_id`; a new
+    document starts after every end-of-text token (which still belongs to the document it ends).
+    Returns `(document_ids, token_positions)`, both shaped like x: document_ids count the
+    documents within each sequence and token_positions restart at 0 with every document, ready
+    for `BasicsTransformerLM.forward`. Computed with a few cumulative ops on whatever device x is on.
+    """
+    is_eos = (x == eos_token_id).to(torch.int64)
+    document_ids = torch.cumsum(is_eos, dim=-1) - is_eos
+    idx = torch.arange(x.size(-1), device=x.device).expand_as(x)
+    # index of the first token of the current document: the running max over document starts
+    starts = torch.where(document_ids != document_ids.roll(1, dims=-1), idx, torch.zeros_like(idx))
+    token_positions = idx - torch.cummax(starts, dim=-1).values
+    return document_ids, token_positions
+
+
+class BatchSampler:
+    """
+    Random batches like `get_batch`, gathered into reusable (pinned, for CUDA) host buffers.
+
+    All batch_size x (context_length + 1) tokens of a batch are fetched from the memmap with one
+    vectorized index operation straight into an int64 buffer; x and y are (non-contiguous) views
+    of it, so flatten them with `reshape` rather than `view`. Buffers are used round-robin, so
+    the tensors of a batch stay valid for `num_buffers - 1` further calls (enough for the
+    one-batch-ahead prefetch of the training loop with the default of 2).
+    """
+
+    def __init__(
+        self,
+        dataset: npt.NDArray,
+        batch_size: int,
+        context_length: int,
+        device: str,
+        num_buffers: int = 2,
+        generator: torch.Generator | None = None,
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.device = device
+        self.generator = generator
+        self.is_cuda = "cuda" in device
+        self.buffers = [
+            torch.empty((batch_size, context_length + 1), dtype=torch.int64, pin_memory=self.is_cuda)
+            for _ in range(num_buffers)
+        ]
+        # a buffer may only be refilled once its previous host-to-device copy has finished
+        self.copy_done: list[torch.cuda.Event | None] = [None] * num_buffers
+        self.step = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.sample()
+
+    def _starting_idxs(self) -> npt.NDArray:
+        return torch.randint(
+            len(self.dataset) - self.context_length, (self.batch_size,), generator=self.generator
+        ).numpy()
+
+    def sample(self) -> tuple[torch.Tensor, torch.Tensor]:
+        starting_idxs = self._starting_idxs()
+        slot = self.step % len(self.buffers)
+        self.step += 1
+        if self.copy_done[slot] is not None:
+            self.copy_done[slot].synchronize()
+        # a short final batch (EpochSampler with drop_last=False) fills the first rows only
+        buffer = self.buffers[slot][: len(starting_idxs)]
+        _gather_windows(self.dataset, starting_idxs, self.context_length + 1, out=buffer.numpy())
+        if self.is_cuda:
+            tokens = buffer.to(self.device, non_blocking=True)
+            self.copy_done[slot] = torch.cuda.Event()
+            self.copy_done[slot].record()
+        else:
+            tokens = buffer if self.device == "cpu" else buffer.to(self.device)
+        return tokens[:, :-1], tokens[:, 1:]
+
+
+class EpochSampler(BatchSampler):
+    """
+    Batches of non-overlapping windows, every window exactly once per epoch, sharded over ranks.
+
+    The dataset is cut into `(len(dataset) - 1) // context_length` windows at a stride of
+    context_length (each holds context_length + 1 tokens, so every token is a target once). Each
+    epoch shuffles the window indices with a generator seeded by (seed, epoch), so all ranks
+    compute the same permutation without communicating, and rank r takes every world_size-th
+    window of it. With drop_last, the shards are trimmed to the same number of full batches so
+    that all ranks take the same number of steps; without it every window is handed out once (the
+    last batch may be short and shards may differ by one window). With shuffle=False the windows
+    are visited in order (a full validation pass); max_windows restricts every epoch to the first
+    max_windows windows of its order (with shuffle and a fixed seed: the same random subsample).
+
+    The position in the data order is `(epoch, consumed)`, with `consumed` counted in windows
+    over all ranks: `state_dict()` / `load_state_dict()` resume it exactly. Since the shards
+    interleave the permutation, the first c windows of all shards are its first c * world_size
+    entries, so a run resumed with a different world size also continues right after the windows
+    already seen. `num_epochs=None` cycles forever; otherwise `sample` raises StopIteration once
+    the last epoch is exhausted.
+    """
+
+    def __init__(
+        self,
+        dataset: npt.NDArray,
+        batch_size: int,
+        context_length: int,
+        device: str,
+        rank: int = 0,
+        world_size: int = 1,
+        seed: int = 0,
+        shuffle: bool = True,
+        drop_last: bool = True,
+        num_epochs: int | None = None,
+        max_windows: int | None = None,
+        num_buffers: int = 2,
+    ):
+        super().__init__(dataset, batch_size, context_length, device, num_buffers=num_buffers)
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank must be in [0, {world_size}), got {rank}")
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_epochs = num_epochs
+        self.num_windows = max(0, (len(dataset) - 1) // context_length)
+        self.epoch_windows = self.num_windows if max_windows is None else min(max_windows, self.num_windows)
+        if drop_last:
+            self.windows_per_rank = self.epoch_windows // world_size
+        else:
+            self.windows_per_rank = len(range(rank, self.epoch_windows, world_size))
+        if self.batches_per_epoch == 0:
+            raise ValueError(
+                f"{len(dataset)} tokens give {self.num_windows} windows of {context_length} tokens, "
+                f"not enough for one batch of {batch_size} on each of {world_size} ranks"
+            )
+        self.epoch = 0
+        self.cursor = 0  # windows of this rank's shard already handed out
+        self._shard: npt.NDArray[np.int64] | None = None
+
+    @property
+    def batches_per_epoch(self) -> int:
+        if self.drop_last:
+            return self.windows_per_rank // self.batch_size
+        return -(-self.windows_per_rank // self.batch_size)
+
+    @property
+    def windows_per_epoch(self) -> int:
+        """windows handed out by this rank in one epoch"""
+        if self.drop_last:
+            return self.batches_per_epoch * self.batch_size
+        return self.windows_per_rank
+
+    @property
+    def tokens_per_epoch(self) -> int:
+        """target tokens seen by all ranks together in one epoch"""
+        if self.drop_last:
+            return self.windows_per_epoch * self.world_size * self.context_length
+        return self.epoch_windows * self.context_length
+
+    def __len__(self) -> int:
+        return self.batches_per_epoch
+
+    def _epoch_shard(self) -> npt.NDArray[np.int64]:
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(self.num_windows)
+        else:
+            order = np.arange(self.num_windows)
+        shard = order[: self.epoch_windows][self.rank :: self.world_size][: self.windows_per_rank]
+        return shard * self.context_length
+
+    def _starting_idxs(self) -> npt.NDArray:
+        if self.cursor >= self.windows_per_epoch:
+            self.epoch += 1
+            self.cursor = 0
+            self._shard = None
+        if self.num_epochs is not None and self.epoch >= self.num_epochs:
+            raise StopIteration
+        if self._shard is None:
+            self._shard = self._epoch_shard()
+        starting_idxs = self._shard[self.cursor : min(self.cursor + self.batch_size, self.windows_per_epoch)]
+        self.cursor += len(starting_idxs)
+        return starting_idxs
+
+    def state_dict(self) -> dict:
+        return {"epoch": self.epoch, "consumed": self.cursor * self.world_size, "seed": self.seed}
+
+    def load_state_dict(self, state: dict):
+        if state.get("seed", self.seed) != self.seed:
+            raise ValueError(f"data state was saved with seed {state['seed']}, this sampler uses {self.seed}")
+        self.epoch = int(state["epoch"])
+        self.cursor = int(state["consumed"]) // self.world_size
+        self._shard = None
+
+
+class PrefetchLoader:
+    """
+    `BatchSampler` batches produced by background threads into a bounded queue.
+
+    Each of `num_workers` threads draws start indices from its own generator (seeded with
+    `seed + worker`), gathers the windows into a pinned host buffer from a shared pool and, for
+    CUDA, issues the host-to-device copy on its own stream, so both the gather and the transfer
+    overlap with the training step. At most `prefetch_depth` batches wait in the queue. The
+    tensors of a batch stay valid for `keep_alive - 1` further calls (buffers are recycled after
+    that). With one worker the batch sequence is deterministic given the seed; with several the
+    interleaving of the workers is not. `sample` raises once the loader is closed or a worker has
+    failed (with the worker's exception) rather than waiting for batches that will never come.
+    """
+
+    def __init__(
+        self,
+        dataset: npt.NDArray,
+        batch_size: int,
+        context_length: int,
+        device: str,
+        prefetch_depth: int = 4,
+        num_workers: int = 1,
+        seed: int = 0,
+        keep_alive: int = 2,
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.device = device
+        self.is_cuda = "cuda" in device
+        self.keep_alive = keep_alive
+        self.ready: queue.Queue = queue.Queue(maxsize=prefetch_depth)
+        self.free: queue.Queue = queue.Queue()
+        # every buffer is either queued, being filled, held by the consumer, or free
+        for _ in range(prefetch_depth + num_workers + keep_alive):
+            buffer = torch.empty((batch_size, context_length + 1), dtype=torch.int64, pin_memory=self.is_cuda)
+            self.free.put((buffer, None))
+        self.in_use: collections.deque = collections.deque()
+        self.stop = threading.Event()
+        self.error: BaseException | None = None
+        self.workers = [
+            threading.Thread(target=self._produce, args=(seed + worker,), name=f"PrefetchLoader-{worker}", daemon=True)
+            for worker in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _produce(self, seed: int):
+        try:
+            generator = torch.Generator().manual_seed(seed)
+            stream = torch.cuda.Stream(device=self.device) if self.is_cuda else None
+            while not self.stop.is_set():
+                buffer, copy_done = self.free.get()
+                if buffer is None:
+                    return
+                if copy_done is not None:
+                    copy_done.synchronize()
+                starting_idxs = torch.randint(
+                    len(self.dataset) - self.context_length, (self.batch_size,), generator=generator
+                )
+                _gather_windows(self.dataset, starting_idxs.numpy(), self.context_length + 1, out=buffer.numpy())
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        tokens = buffer.to(self.device, non_blocking=True)
+                        copy_done = torch.cuda.Event()
+                        copy_done.record(stream)
+                else:
+                    tokens = buffer if self.device == "cpu" else buffer.to(self.device)
+                self._put((tokens, buffer, copy_done))
+        except BaseException as e:
+            # surfaced to the training loop on its next call
+            self.error = e
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.ready.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.sample()
+
+    def _next_item(self):
+        while True:
+            if self.error is not None:
+                self.close()
+                raise self.error
+            if self.stop.is_set():
+                raise RuntimeError("PrefetchLoader is closed")
+            try:
+                return self.ready.get(timeout=0.1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("PrefetchLoader workers exited without producing a batch") from None
+
+    def sample(self) -> tuple[torch.Tensor, torch.Tensor]:
+        item = self._next_item()
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+        tokens, buffer, copy_done = item
+        if copy_done is not None:
+            # the copy ran on the worker's stream: order it before the consumer's kernels,
+            # and tell the caching allocator that the tensor is used on this stream
+            current = torch.cuda.current_stream(self.device)
+            current.wait_event(copy_done)
+            tokens.record_stream(current)
+            # the host buffer is free as soon as the copy has finished, the worker waits for that
+            self.free.put((buffer, copy_done))
+        else:
+            self.in_use.append(buffer)
+            if len(self.in_use) > self.keep_alive:
+                self.free.put((self.in_use.popleft(), None))
+        return tokens[:, :-1], tokens[:, 1:]
+
+    def close(self):
+        self.stop.set()
+        for _ in self.workers:
+            self.free.put((None, None))
+        for worker in self.workers:
+            worker.join(timeout=1.0)
@@ -23,7 +23,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from einops import einsum, rearrange
-from jaxtyping import Float, Int
+from jaxtyping import Bool, Float, Int
 from torch import Tensor
 from torch.nn.attention import SDPBackend, sdpa_kernel
 
@@ -109,6 +109,24 @@ class RotaryEmbedding(nn.Module):
         return f"context_length={self._freq_cis_cache.shape[0]}, dim/2={self._freq_cis_cache.shape[1]}"
 
 
+def document_causal_mask(document_ids: Int[Tensor, " ... seq"]) -> Bool[Tensor, " ... 1 seq seq"]:
+    """Block-diagonal causal attention mask of packed sequences.
+
+    Args:
+        document_ids: Int[Tensor, " ... seq"]
+            The document of every token; tokens of a document are contiguous.
+
+    Returns:
+        BoolTensor that is True where the query (row) may attend to the key (column): the key
+        comes no later than the query and belongs to the same document. The singleton dimension
+        broadcasts over the attention heads.
+    """
+    sequence_length = document_ids.size(-1)
+    causal = torch.ones(sequence_length, sequence_length, dtype=torch.bool, device=document_ids.device).tril()
+    same_document = document_ids[..., :, None] == document_ids[..., None, :]
+    return (same_document & causal).unsqueeze(-3)
+
+
 class BasicsTransformerLM(nn.Module):
     """A Transformer language model.
 
@@ -184,10 +202,19 @@ class BasicsTransformerLM(nn.Module):
 
         return n_params
 
-    def forward(self, x: Int[Tensor, " ... sequence_length"]) -> Float[Tensor, " ... sequence_length vocab_size"]:
+    def forward(
+        self,
+        x: Int[Tensor, " ... sequence_length"],
+        token_positions: Int[Tensor, " ... sequence_length"] | None = None,
+        document_ids: Int[Tensor, " ... sequence_length"] | None = None,
+    ) -> Float[Tensor, " ... sequence_length vocab_size"]:
         """
         Args:
             x: Input IDs for language modeling.
+            token_positions: RoPE positions of the tokens (default: 0, 1, ... along the sequence).
+                For packed sequences, the position of every token within its own document.
+            document_ids: For packed sequences, the document each token belongs to. Attention is
+                then restricted to earlier tokens of the same document (a block-diagonal causal mask).
 
         Returns: A FloatTensor of shape
             (batch size, sequence_length, vocab_size) with the predicted unnormalized next-word
@@ -195,12 +222,16 @@ class BasicsTransformerLM(nn.Module):
         """
         _, sequence_length = x.size()
 
+        attn_mask = None
+        if document_ids is not None:
+            attn_mask = document_causal_mask(document_ids)
+
         # (batch size, sequence_length, d_model)
         x = self.token_embeddings(x)
 
         for layer in self.layers:
             # (batch size, sequence_length, d_model)
-            x = layer(x)
+            x = layer(x, token_positions=token_positions, attn_mask=attn_mask)
 
         # (batch size, sequence_length, d_model)
         x = self.ln_final(x)
@@ -322,11 +353,20 @@ class TransformerBlock(nn.Module):
         self.ln1 = nn.RMSNorm(d_model)
         self.ln2 = nn.RMSNorm(d_model)
 
-    def forward(self, x: torch.Tensor):
+    def forward(
+        self,
+        x: torch.Tensor,
+        token_positions: torch.Tensor | None = None,
+        attn_mask: torch.Tensor | None = None,
+    ):
         """
         Args:
             x: FloatTensor of shape `(batch_size, sequence_length, d_model)`.
                 The input to process with the Transformer block.
+            token_positions: Optional LongTensor of shape `(batch_size, sequence_length)`
+                with the RoPE positions of the tokens.
+            attn_mask: Optional BoolTensor of shape `(batch_size, 1, sequence_length, sequence_length)`,
+                True where a query may attend to a key (replaces the plain causal mask).
 
         Returns:
             FloatTensor of shape `(batch_size, sequence_length, d_model)`.
@@ -334,7 +374,7 @@ class TransformerBlock(nn.Module):
         # NOTE: this is a pre-norm Transformer, and differs from the original
         # description in the paper.
         # Apply the multi-head self-attention sublayer
-        x_attn = self.attn(self.ln1(x))
+        x_attn = self.attn(self.ln1(x), token_positions=token_positions, attn_mask=attn_mask)
         attn_sublayer_output = x + x_attn
 
         # Apply the feed-forward sublayer
@@ -398,12 +438,17 @@ class CausalMultiHeadSelfAttention(nn.Module):
         self.positional_encoder = positional_encoder  # RoPE
 
     def forward(
-        self, x: Float[Tensor, " ... seq d_k"], token_positions: Int[Tensor, " ... seq"] | None = None
+        self,
+        x: Float[Tensor, " ... seq d_k"],
+        token_positions: Int[Tensor, " ... seq"] | None = None,
+        attn_mask: Bool[Tensor, " ... 1 seq seq"] | None = None,
     ) -> Float[Tensor, " ... seq d_v"]:
         """
         Args:
             x: The input to perform multi-headed self-attention on.
             positional_ids: The positional indices along the sequence dimension of the input embeddings.
+            attn_mask: Which keys each query may attend to, already including causality
+                (see `document_causal_mask`). Plain causal attention if not given.
 
         Returns:
             Self-attention outputs.
@@ -437,7 +482,8 @@ class CausalMultiHeadSelfAttention(nn.Module):
             query=Q,
             key=K,
             value=V,
-            is_causal=True,
+            attn_mask=attn_mask,
+            is_causal=attn_mask is None,
             enable_gqa=False
         )
 
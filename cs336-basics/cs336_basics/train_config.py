@@ -14,6 +14,8 @@ class PathsConfig:
     train_bin: Path = MISSING
     valid_bin: Path = MISSING
     model_output: Path = MISSING
+    # data_state.json of a checkpoint, to continue the "epoch" data order where it stopped
+    resume_data_state: Path | None = None
 
 
 @dataclass
@@ -36,7 +38,9 @@ class TrainingConfig:
     train_steps: int = 100_000
     gradient_accumulation_steps: int = 1
     compile: bool = True
-    eval_iterations: int = 1_000
+    # batches of eval_batch_size per intermediate evaluation, taken from a fixed seeded subset of the
+    # dev windows and split over the ranks (None: a full pass every time; the final evaluation always is)
+    eval_iterations: int | None = 1_000
     eval_interval: int = 2_000
     max_grad_norm: float | None = 1.0
     device: str = "cuda"
@@ -50,6 +54,15 @@ class TrainingConfig:
     wandb_entity: str | None = None
     log_interval: int = 20
     save_checkpoints: bool = False
+    # "prefetch": background threads fill a bounded queue of batches; "sync": sample on the training thread;
+    # "epoch": every non-overlapping window once per epoch in a seeded order, sharded over the DDP ranks
+    data_loader: str = "sync"
+    prefetch_depth: int = 4
+    data_loader_workers: int = 1
+    # restart attention and RoPE positions at every end-of-text token, so that packed windows do not
+    # attend across document boundaries (eos_token_id is GPT-2's <|endoftext|>)
+    document_masking: bool = False
+    eos_token_id: int = 50256
 
 @dataclass
 class Config:
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+
+import typer
+
+from cs336_basics.corpus import build_tokenized_corpus
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize_corpus(
+    inputs: list[Path],
+    output: Path = typer.Option(..., help="uint16 .bin to write; the offsets index is written next to it"),
+    num_workers: int | None = None,
+    files_per_task: int = 256,
+    encoding_name: str = "gpt2",
+    text_field: str = "text",
+):
+    num_docs, num_tokens = build_tokenized_corpus(
+        inputs,
+        output,
+        num_workers=num_workers,
+        files_per_task=files_per_task,
+        encoding_name=encoding_name,
+        text_field=text_field,
+    )
+    print(f"{num_docs} documents, {num_tokens} tokens -> {output}")
+
+
+if __name__ == "__main__":
+    """
+    Tokenize the filtered corpus (e.g. the output directory of cs336_data.generate_data) into the
+    `paths.train_bin` expected by scripts/train.py.
+
+    Usage: uv run scripts/tokenize_corpus.py /path/to/filtered_docs --output /path/to/train.bin
+    """
+    logging.basicConfig(level=logging.INFO)
+    typer.run(tokenize_corpus)
@@ -5,6 +5,7 @@ Default config is `experiment/your_data`, which will train on your GPT-2 tokeniz
 
 To ready the config for your run, you should:
 1. open the config file at `cs336-basics/configs/experiment/your_data.yaml` and set the `paths.train_bin` attribute to point to the file containing your tokenized training data.
+   `scripts/tokenize_corpus.py` builds it from a directory of filtered documents.
 2. You should also set an appropriate `training.wandb_entity` and `training.wandb_project` attribute for logging.
 
 To run single-GPU training:
@@ -31,6 +32,7 @@ import hydra
 import numpy as np
 import numpy.typing as npt
 import torch
+import torch.distributed as dist
 import torch.nn.functional as F
 from omegaconf import OmegaConf
 from rich.pretty import pprint as pprint
@@ -40,7 +42,7 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from tqdm import tqdm, trange
 
 import wandb
-from cs336_basics.data import get_batch
+from cs336_basics.data import BatchSampler, EpochSampler, PrefetchLoader, packed_document_positions
 from cs336_basics.model import BasicsTransformerLM
 from cs336_basics.optimizer import get_cosine_lr
 from cs336_basics.train_config import Config, register_configs
@@ -93,6 +95,7 @@ def main(cfg: Config) -> None:
             logger.info("Using DDP")
     else:
         seed = cfg.training.seed
+        ddp_rank = 0
         ddp_world_size = 1
         is_master_process = True
 
@@ -140,6 +143,13 @@ def main(cfg: Config) -> None:
 
     amp_ctx = torch.amp.autocast(device_type="cuda", dtype=torch_dtype)
 
+    eos_token_id = cfg.training.eos_token_id if cfg.training.document_masking else None
+    eval_tokens = None
+    if cfg.training.eval_iterations is not None:
+        eval_tokens = cfg.training.eval_iterations * cfg.training.eval_batch_size * cfg.model.context_length
+    if is_master_process and eos_token_id is not None:
+        logger.info(f"Masking attention across documents separated by token {eos_token_id}")
+
     # Move model to the device
     model = model.to(cfg.training.device)
 
@@ -147,6 +157,9 @@ def main(cfg: Config) -> None:
     if cfg.training.compile:
         model = torch.compile(model)
 
+    # evaluation bypasses the DDP wrapper: it runs no backward pass and its forwards must not
+    # trigger DDP's collectives, since the ranks may evaluate different numbers of batches
+    eval_model = model
     if is_ddp:
         model = DDP(model, device_ids=[ddp_local_rank])
 
@@ -172,12 +185,46 @@ def main(cfg: Config) -> None:
     )
 
     # Get the first batch
-    batch_x, batch_y = get_batch(
-        train_data,
-        batch_size=cfg.training.train_batch_size,
-        context_length=cfg.model.context_length,
-        device=cfg.training.device,
-    )
+    if cfg.training.data_loader == "prefetch":
+        train_batches = PrefetchLoader(
+            train_data,
+            batch_size=cfg.training.train_batch_size,
+            context_length=cfg.model.context_length,
+            device=cfg.training.device,
+            prefetch_depth=cfg.training.prefetch_depth,
+            num_workers=cfg.training.data_loader_workers,
+            seed=seed,
+        )
+    elif cfg.training.data_loader == "sync":
+        train_batches = BatchSampler(
+            train_data,
+            batch_size=cfg.training.train_batch_size,
+            context_length=cfg.model.context_length,
+            device=cfg.training.device,
+        )
+    elif cfg.training.data_loader == "epoch":
+        # same seed on every rank: the ranks share one permutation and take disjoint shards of it
+        train_batches = EpochSampler(
+            train_data,
+            batch_size=cfg.training.train_batch_size,
+            context_length=cfg.model.context_length,
+            device=cfg.training.device,
+            rank=ddp_rank,
+            world_size=ddp_world_size,
+            seed=cfg.training.seed,
+        )
+        if cfg.paths.resume_data_state is not None:
+            with open(cfg.paths.resume_data_state) as f:
+                train_batches.load_state_dict(json.load(f))
+        if is_master_process:
+            logger.info(
+                f"{train_batches.batches_per_epoch} batches per rank and epoch, "
+                f"{train_batches.tokens_per_epoch} unique tokens per epoch, starting at {train_batches.state_dict()}"
+            )
+    else:
+        raise ValueError(f"Unknown data_loader: {cfg.training.data_loader}")
+
+    batch_x, batch_y = train_batches.sample()
     for i in (pbar := trange(cfg.training.train_steps, desc="Training", disable=not is_master_process)):
         lr = get_cosine_lr(
             i,
@@ -195,19 +242,18 @@ def main(cfg: Config) -> None:
                 model.require_backward_grad_sync = micro_step_idx == cfg.training.gradient_accumulation_steps - 1
 
             with amp_ctx:
-                logits = model(batch_x)
-
-                # immediately async prefetch next batch while model is doing the forward pass on the GPU
-                next_batch_x, next_batch_y = get_batch(
-                    train_data,
-                    batch_size=cfg.training.train_batch_size,
-                    context_length=cfg.model.context_length,
-                    device=cfg.training.device,
-                )
+                logits = lm_logits(model, batch_x, eos_token_id)
+
+                # take the next batch while the model is doing the forward pass on the GPU
+                # (with the prefetch loader it has already been gathered in the background)
+                if isinstance(train_batches, EpochSampler):
+                    # position after the batches trained on so far, i.e. excluding the one drawn ahead
+                    data_state = train_batches.state_dict()
+                next_batch_x, next_batch_y = train_batches.sample()
 
                 # Calculate the loss with the logits
                 loss = (
-                    F.cross_entropy(logits.view(-1, logits.size(-1)), batch_y.view(-1))
+                    F.cross_entropy(logits.view(-1, logits.size(-1)), batch_y.reshape(-1))
                     / cfg.training.gradient_accumulation_steps
                 )
 
@@ -229,20 +275,26 @@ def main(cfg: Config) -> None:
             if cfg.training.wandb_project and i % cfg.training.log_interval == 0:
                 wandb.log({"train_loss": loss_float, "lr": lr}, step=i)
 
-        if i != 0 and i % cfg.training.eval_interval == 0 and is_master_process:
-            dev_loss = estimate_dev_loss(
-                model=model,
-                dev_dataset=dev_data,
+        if i != 0 and i % cfg.training.eval_interval == 0:
+            # every rank evaluates its share of the dev windows
+            dev_loss = evaluate_loss(
+                model=eval_model,
+                dataset=dev_data,
                 batch_size=cfg.training.eval_batch_size,
-                eval_iters=cfg.training.eval_iterations,
-                device=cfg.training.device,
                 context_length=cfg.model.context_length,
+                device=cfg.training.device,
+                rank=ddp_rank,
+                world_size=ddp_world_size,
+                max_tokens=eval_tokens,
+                seed=cfg.training.seed,
+                eos_token_id=eos_token_id,
             )
-            logger.info(f"Estimated validation loss: {dev_loss}")
-            if cfg.training.wandb_project:
-                wandb.log({"eval_loss": dev_loss}, step=i)
+            if is_master_process:
+                logger.info(f"Estimated validation loss: {dev_loss}")
+                if cfg.training.wandb_project:
+                    wandb.log({"eval_loss": dev_loss}, step=i)
 
-            if cfg.training.save_checkpoints:
+            if cfg.training.save_checkpoints and is_master_process:
                 model_weights_output_path = cfg.paths.model_output / f"step_{i:010d}" / "model.pt"
                 model_weights_output_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -254,17 +306,27 @@ def main(cfg: Config) -> None:
                 # Write weights:
                 torch.save(model.state_dict(), model_weights_output_path)
 
-    # Calculate final estimated dev loss
+                # Position in the data order, to resume with paths.resume_data_state
+                if isinstance(train_batches, EpochSampler):
+                    with open(model_weights_output_path.parent / "data_state.json", "w") as f:
+                        json.dump(data_state, f, indent=4)
+
+    if isinstance(train_batches, PrefetchLoader):
+        train_batches.close()
+
+    # Calculate the final dev loss over the whole dev set
+    dev_loss = evaluate_loss(
+        model=eval_model,
+        dataset=dev_data,
+        batch_size=cfg.training.eval_batch_size,
+        context_length=cfg.model.context_length,
+        device=cfg.training.device,
+        rank=ddp_rank,
+        world_size=ddp_world_size,
+        eos_token_id=eos_token_id,
+    )
     if is_master_process:
-        dev_loss = estimate_dev_loss(
-            model=model,
-            dev_dataset=dev_data,
-            batch_size=cfg.training.eval_batch_size,
-            eval_iters=cfg.training.eval_iterations,
-            device=cfg.training.device,
-            context_length=cfg.model.context_length,
-        )
-        logger.info(f"Final estimated validation loss: {dev_loss}")
+        logger.info(f"Final validation loss: {dev_loss}")
         if cfg.training.wandb_project:
             wandb.log({"eval_loss": dev_loss}, step=cfg.training.train_steps)
 
@@ -277,30 +339,60 @@ def main(cfg: Config) -> None:
         destroy_process_group()
 
 
+def lm_logits(model: BasicsTransformerLM, batch_x: torch.Tensor, eos_token_id: int | None = None) -> torch.Tensor:
+    """logits of a batch; with an eos_token_id, attention and positions restart at every document"""
+    if eos_token_id is None:
+        return model(batch_x)
+    document_ids, token_positions = packed_document_positions(batch_x, eos_token_id)
+    return model(batch_x, token_positions=token_positions, document_ids=document_ids)
+
+
 @torch.no_grad()
-def estimate_dev_loss(
+def evaluate_loss(
     model: BasicsTransformerLM,
-    dev_dataset: npt.NDArray,
+    dataset: npt.NDArray,
     batch_size: int,
-    eval_iters: int,
-    device: str,
     context_length: int,
-):
+    device: str,
+    rank: int = 0,
+    world_size: int = 1,
+    max_tokens: int | None = None,
+    seed: int = 0,
+    eos_token_id: int | None = None,
+) -> float:
+    """
+    Mean next-token loss over non-overlapping windows of the dataset, each evaluated once.
+
+    The windows are sharded over the ranks (every rank calls this with its own rank). Losses are
+    summed on the device and all-reduced once at the end, which is also the only host sync. With
+    max_tokens, only a fixed seeded subset of about max_tokens target tokens is evaluated, the same
+    windows at every call, so that intermediate evaluations are cheap and comparable.
+    """
+    windows = EpochSampler(
+        dataset,
+        batch_size=batch_size,
+        context_length=context_length,
+        device=device,
+        rank=rank,
+        world_size=world_size,
+        seed=seed,
+        shuffle=max_tokens is not None,
+        drop_last=False,
+        num_epochs=1,
+        max_windows=None if max_tokens is None else -(-max_tokens // context_length),
+    )
+    was_training = model.training
     model.eval()
-    losses = torch.zeros(eval_iters, device=device)
-    for k in tqdm(range(eval_iters)):
-        batch_x, batch_y = get_batch(
-            dev_dataset,
-            batch_size=batch_size,
-            context_length=context_length,
-            device=device,
-        )
-        logits = model(batch_x)
-        loss = F.cross_entropy(logits.view(-1, logits.size(-1)), batch_y.view(-1))
-        losses[k] = loss.item()
-
-    model.train()
-    return losses.mean()
+    # summed loss and number of target tokens
+    totals = torch.zeros(2, dtype=torch.float64, device=device)
+    for batch_x, batch_y in tqdm(windows, desc="Evaluating", disable=rank != 0):
+        logits = lm_logits(model, batch_x, eos_token_id)
+        totals[0] += F.cross_entropy(logits.view(-1, logits.size(-1)), batch_y.reshape(-1), reduction="sum")
+        totals[1] += batch_y.numel()
+    if world_size > 1:
+        dist.all_reduce(totals)
+    model.train(was_training)
+    return (totals[0] / totals[1]).item()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from cs336_basics import corpus
+
+
+class ByteEncoding:
+    """byte-level stand-in for a tiktoken encoding, so that no vocabulary has to be downloaded"""
+
+    eot_token = 256
+
+    def encode_ordinary_batch(self, texts: list[str], num_threads: int = 1) -> list[list[int]]:
+        return [list(text.encode("utf-8")) for text in texts]
+
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(corpus, "_get_encoding", lambda encoding_name: ByteEncoding())
+    # the workers must see the patched encoding
+    monkeypatch.setattr(corpus, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+
+@pytest.fixture
+def documents(tmp_path):
+    inputs = tmp_path / "inputs"
+    (inputs / "nested").mkdir(parents=True)
+    (inputs / "a.txt").write_text("first document")
+    with gzip.open(inputs / "b.jsonl.gz", "wt") as f:
+        for text in ("second", "third, with ünïcödé"):
+            f.write(json.dumps({"text": text}) + "\n")
+    (inputs / "nested" / "c.txt").write_text("fourth")
+    (inputs / "notes.csv").write_text("not a document")
+    return inputs, ["first document", "second", "third, with ünïcödé", "fourth"]
+
+
+def test_build_tokenized_corpus(byte_encoding, documents, tmp_path):
+    inputs, texts = documents
+    output_path = tmp_path / "train.bin"
+    num_docs, num_tokens = corpus.build_tokenized_corpus([inputs], output_path, num_workers=2, files_per_task=1)
+
+    expected = [list(text.encode("utf-8")) + [ByteEncoding.eot_token] for text in texts]
+    assert num_docs == len(texts)
+    assert num_tokens == sum(map(len, expected))
+    tokens, offsets = corpus.load_tokenized_corpus(output_path)
+    assert tokens.dtype == corpus.TOKEN_DTYPE
+    assert offsets.tolist() == np.cumsum([0] + [len(doc) for doc in expected]).tolist()
+    for i, doc in enumerate(expected):
+        assert tokens[offsets[i] : offsets[i + 1]].tolist() == doc
+    # no staged shards are left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["inputs", "train.bin", "train.offsets.npy"]
+
+
+def test_build_tokenized_corpus_does_not_depend_on_the_task_split(byte_encoding, documents, tmp_path):
+    inputs, _ = documents
+    corpus.build_tokenized_corpus([inputs], tmp_path / "one.bin", num_workers=1, files_per_task=16)
+    corpus.build_tokenized_corpus([inputs], tmp_path / "many.bin", num_workers=3, files_per_task=1)
+    assert (tmp_path / "one.bin").read_bytes() == (tmp_path / "many.bin").read_bytes()
+    assert np.array_equal(np.load(tmp_path / "one.offsets.npy"), np.load(tmp_path / "many.offsets.npy"))
+
+
+def test_load_tokenized_corpus_without_index(tmp_path):
+    path = tmp_path / "raw.bin"
+    np.arange(10, dtype=corpus.TOKEN_DTYPE).tofile(path)
+    tokens, offsets = corpus.load_tokenized_corpus(path)
+    assert tokens.tolist() == list(range(10))
+    assert offsets is None
@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+import torch
+
+from cs336_basics.data import BatchSampler, EpochSampler, PrefetchLoader, get_batch, packed_document_positions
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """a uint16 token memmap, like the tokenized corpora"""
+    path = tmp_path / "tokens.bin"
+    np.random.default_rng(0).integers(0, 50_000, 1_000, dtype=np.uint16).tofile(path)
+    return np.memmap(path, dtype=np.uint16, mode="r")
+
+
+def test_get_batch_windows(dataset):
+    x, y = get_batch(dataset, batch_size=8, context_length=16, device="cpu")
+    assert x.shape == y.shape == (8, 16)
+    assert x.dtype == y.dtype == torch.int64
+    for row_x, row_y in zip(x.tolist(), y.tolist()):
+        start = next(i for i in range(len(dataset) - 16) if dataset[i : i + 16].tolist() == row_x)
+        assert row_y == dataset[start + 1 : start + 17].tolist()
+
+
+def test_batch_sampler_matches_get_batch(dataset):
+    torch.manual_seed(0)
+    expected = [get_batch(dataset, 8, 16, "cpu") for _ in range(5)]
+    torch.manual_seed(0)
+    sampler = BatchSampler(dataset, 8, 16, "cpu")
+    for expected_x, expected_y in expected:
+        x, y = sampler.sample()
+        assert torch.equal(x, expected_x) and torch.equal(y, expected_y)
+
+
+def test_batch_sampler_generator_and_buffer_reuse(dataset):
+    first = BatchSampler(dataset, 4, 16, "cpu", num_buffers=2, generator=torch.Generator().manual_seed(1))
+    second = BatchSampler(dataset, 4, 16, "cpu", num_buffers=2, generator=torch.Generator().manual_seed(1))
+    x1, _ = first.sample()
+    kept = x1.clone()
+    first.sample()
+    # still valid for num_buffers - 1 further calls
+    assert torch.equal(x1, kept)
+    assert torch.equal(second.sample()[0], kept)
+
+
+def test_prefetch_loader_single_worker_is_deterministic(dataset):
+    loader = PrefetchLoader(dataset, 4, 16, "cpu", prefetch_depth=2, num_workers=1, seed=3)
+    sampler = BatchSampler(dataset, 4, 16, "cpu", generator=torch.Generator().manual_seed(3))
+    try:
+        for _ in range(10):
+            x, y = loader.sample()
+            expected_x, expected_y = sampler.sample()
+            assert torch.equal(x, expected_x) and torch.equal(y, expected_y)
+    finally:
+        loader.close()
+
+
+def test_prefetch_loader_raises_once_closed(dataset):
+    loader = PrefetchLoader(dataset, 4, 16, "cpu", num_workers=2)
+    next(loader)
+    loader.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        loader.sample()
+
+
+class BrokenDataset:
+    def __len__(self):
+        return 1_000
+
+    def __getitem__(self, index):
+        raise OSError("memmap went away")
+
+
+def test_prefetch_loader_surfaces_worker_errors():
+    loader = PrefetchLoader(BrokenDataset(), 4, 16, "cpu", num_workers=2)
+    with pytest.raises(OSError, match="memmap went away"):
+        loader.sample()
+    # the loader is closed, later calls fail with the same error instead of blocking
+    with pytest.raises(OSError, match="memmap went away"):
+        loader.sample()
+
+
+# token i is i, so the first input token of a window is its start
+POSITIONS = np.arange(1_000, dtype=np.uint16)
+
+
+def window_starts(sampler) -> list[int]:
+    return [start for x, _ in sampler for start in x[:, 0].tolist()]
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_epoch_sampler_shards_are_disjoint_and_cover_every_window(drop_last):
+    world_size = 3
+    shards = [
+        window_starts(EpochSampler(
+            POSITIONS, 4, 16, "cpu", rank=rank, world_size=world_size, seed=1, drop_last=drop_last, num_epochs=1
+        ))
+        for rank in range(world_size)
+    ]
+    starts = [start for shard in shards for start in shard]
+    num_windows = (len(POSITIONS) - 1) // 16
+    assert len(starts) == len(set(starts))
+    assert set(starts) <= set(range(0, num_windows * 16, 16))
+    if drop_last:
+        # every rank takes the same number of full batches
+        assert len({len(shard) for shard in shards}) == 1
+        assert all(len(shard) % 4 == 0 for shard in shards)
+    else:
+        assert sorted(starts) == list(range(0, num_windows * 16, 16))
+
+
+def test_epoch_sampler_epochs():
+    # 62 windows, all of them in batches of 2
+    sampler = EpochSampler(POSITIONS, 2, 16, "cpu", seed=1, num_epochs=2)
+    epochs = [[next(sampler)[0][:, 0].tolist() for _ in range(len(sampler))] for _ in range(2)]
+    with pytest.raises(StopIteration):
+        sampler.sample()
+    first, second = (sorted(start for batch in epoch for start in batch) for epoch in epochs)
+    # the same windows in a new order
+    assert first == second and epochs[0] != epochs[1]
+    in_order = window_starts(EpochSampler(POSITIONS, 4, 16, "cpu", shuffle=False, drop_last=False, num_epochs=1))
+    assert in_order == list(range(0, (len(POSITIONS) - 1) // 16 * 16, 16))
+
+
+@pytest.mark.parametrize("consumed_batches", [0, 5, 17])
+def test_epoch_sampler_resumes_from_state_dict(consumed_batches):
+    reference = EpochSampler(POSITIONS, 4, 16, "cpu", seed=2, num_epochs=3)
+    for _ in range(consumed_batches):
+        reference.sample()
+    resumed = EpochSampler(POSITIONS, 4, 16, "cpu", seed=2, num_epochs=3)
+    resumed.load_state_dict(reference.state_dict())
+    assert window_starts(resumed) == window_starts(reference)
+
+    with pytest.raises(ValueError, match="seed"):
+        EpochSampler(POSITIONS, 4, 16, "cpu", seed=3).load_state_dict(reference.state_dict())
+
+
+def test_epoch_sampler_resumes_with_another_world_size():
+    single = EpochSampler(POSITIONS, 2, 16, "cpu", seed=4, num_epochs=1)
+    seen = [start for _ in range(6) for start in single.sample()[0][:, 0].tolist()]
+    rest = []
+    for rank in range(2):
+        sampler = EpochSampler(POSITIONS, 2, 16, "cpu", rank=rank, world_size=2, seed=4, num_epochs=1)
+        sampler.load_state_dict(single.state_dict())
+        rest.extend(window_starts(sampler))
+    # the two ranks continue right after the windows already seen
+    assert not set(seen) & set(rest)
+    assert len(seen) + len(rest) == len(set(seen) | set(rest))
+
+
+def test_packed_document_positions_restart_after_eos():
+    eos = 9
+    x = torch.tensor([
+        [1, 2, eos, 3, 4, 5, eos, 6],
+        [eos, eos, 1, 2, 3, 4, 5, 6],
+        [1, 2, 3, 4, 5, 6, 7, 8],
+    ])
+    document_ids, token_positions = packed_document_positions(x, eos)
+    # the end-of-text token belongs to the document it ends
+    assert document_ids.tolist() == [
+        [0, 0, 0, 1, 1, 1, 1, 2],
+        [0, 1, 2, 2, 2, 2, 2, 2],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+    ]
+    assert token_positions.tolist() == [
+        [0, 1, 2, 0, 1, 2, 3, 0],
+        [0, 0, 0, 1, 2, 3, 4, 5],
+        [0, 1, 2, 3, 4, 5, 6, 7],
+    ]
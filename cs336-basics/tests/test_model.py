@@ -0,0 +1,33 @@
+import torch
+
+from cs336_basics.data import packed_document_positions
+from cs336_basics.model import BasicsTransformerLM, document_causal_mask
+
+
+def test_document_causal_mask_is_block_diagonal_and_causal():
+    document_ids = torch.tensor([[0, 0, 0, 1, 1, 2], [0, 0, 0, 0, 0, 0]])
+    mask = document_causal_mask(document_ids)
+    assert mask.shape == (2, 1, 6, 6)
+    for b in range(2):
+        for query in range(6):
+            for key in range(6):
+                allowed = key <= query and document_ids[b, key] == document_ids[b, query]
+                assert mask[b, 0, query, key] == allowed
+    # a single document is plain causal attention
+    assert torch.equal(mask[1, 0], torch.ones(6, 6, dtype=torch.bool).tril())
+
+
+def test_packed_documents_do_not_attend_to_each_other():
+    torch.manual_seed(0)
+    model = BasicsTransformerLM(32, 16, 32, 2, 4, 64, 10000.0).eval()
+    eos = 31
+    first, second = torch.tensor([[1, 2, 3, eos]]), torch.tensor([[4, 5, 6, 7, 8]])
+    packed = torch.cat([first, second], dim=-1)
+    document_ids, token_positions = packed_document_positions(packed, eos)
+    with torch.no_grad():
+        logits = model(packed, token_positions=token_positions, document_ids=document_ids)
+        # every document scores as if it were on its own
+        assert torch.allclose(logits[:, :4], model(first), atol=1e-5)
+        assert torch.allclose(logits[:, 4:], model(second), atol=1e-5)
+        # without document ids the second document sees the first
+        assert not torch.allclose(model(packed)[:, 4:], model(second), atol=1e-5)
@@ -0,0 +1,64 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from cs336_basics.model import BasicsTransformerLM
+
+# the training script imports wandb (and hydra) at the top
+pytest.importorskip("wandb")
+
+TRAIN_SCRIPT = Path(__file__).resolve().parents[1] / "scripts" / "train.py"
+CONTEXT_LENGTH = 16
+
+
+@pytest.fixture(scope="module")
+def train():
+    spec = importlib.util.spec_from_file_location("train_script", TRAIN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return BasicsTransformerLM(100, CONTEXT_LENGTH, 32, 2, 4, 64, 10000.0)
+
+
+@pytest.fixture
+def dataset():
+    return np.random.default_rng(0).integers(0, 100, 1_000).astype(np.uint16)
+
+
+def reference_loss(model, dataset, starts) -> float:
+    x = torch.from_numpy(np.stack([dataset[s : s + CONTEXT_LENGTH] for s in starts]).astype(np.int64))
+    y = torch.from_numpy(np.stack([dataset[s + 1 : s + CONTEXT_LENGTH + 1] for s in starts]).astype(np.int64))
+    with torch.no_grad():
+        logits = model(x)
+    return F.cross_entropy(logits.reshape(-1, logits.size(-1)), y.reshape(-1)).item()
+
+
+def test_evaluate_loss_full_pass(train, model, dataset):
+    num_windows = (len(dataset) - 1) // CONTEXT_LENGTH
+    expected = reference_loss(model, dataset, range(0, num_windows * CONTEXT_LENGTH, CONTEXT_LENGTH))
+    # eval_iterations=None evaluates with max_tokens=None: every window once, whatever the batch size
+    for batch_size in (1, 7, 64):
+        assert train.evaluate_loss(model, dataset, batch_size, CONTEXT_LENGTH, "cpu") == pytest.approx(expected)
+    # a token budget covering the whole set is the full pass in another order
+    whole = train.evaluate_loss(model, dataset, 7, CONTEXT_LENGTH, "cpu", max_tokens=num_windows * CONTEXT_LENGTH)
+    assert whole == pytest.approx(expected)
+    assert model.training
+
+
+def test_evaluate_loss_subset_is_deterministic(train, model, dataset):
+    subset = train.evaluate_loss(model, dataset, 4, CONTEXT_LENGTH, "cpu", max_tokens=200, seed=1)
+    assert train.evaluate_loss(model, dataset, 4, CONTEXT_LENGTH, "cpu", max_tokens=200, seed=1) == subset
+    # the same windows in other batches
+    rebatched = train.evaluate_loss(model, dataset, 5, CONTEXT_LENGTH, "cpu", max_tokens=200, seed=1)
+    assert rebatched == pytest.approx(subset)
+    assert train.evaluate_loss(model, dataset, 4, CONTEXT_LENGTH, "cpu", max_tokens=200, seed=2) != subset
+    assert subset != pytest.approx(train.evaluate_loss(model, dataset, 4, CONTEXT_LENGTH, "cpu"))
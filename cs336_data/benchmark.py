@@ -0,0 +1,489 @@
+"""
+Benchmarks for the hot paths of the data pipeline on synthetic corpora.
+
+    python -m cs336_data.benchmark run --docs 2000 --output main.json
+    python -m cs336_data.benchmark run --docs 2000 --output branch.json
+    python -m cs336_data.benchmark compare main.json branch.json
+
+The corpus (plain text documents with PII, repeated boilerplate lines and
+near-duplicates, their HTML renderings and a WARC file of them) is generated
+from a seed, so two runs with the same config measure the same input. Each
+benchmark runs in its own spawned process by default so that its peak RSS is
+not polluted by the benchmarks before it. Benchmarks that need model files
+which are not on disk are reported as skipped.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import cached_property
+
+import numpy as np
+
+from cs336_data import common
+
+logger = logging.getLogger(__name__)
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "ven", "dor", "pel", "an", "is", "or", "ul", "tre", "gan"]
+BOILERPLATE = [
+    "Home | About | Contact | Privacy Policy",
+    "Copyright 2024 All rights reserved.",
+    "Subscribe to our newsletter for the latest updates.",
+    "Click here to accept cookies.",
+]
+
+
+@dataclass
+class CorpusConfig:
+    num_docs: int = 1000
+    words_per_doc: int = 300
+    vocab_size: int = 5000
+    duplicate_fraction: float = 0.1
+    seed: int = 0
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+class Corpus:
+    """synthetic documents and their on-disk renderings, created lazily in workdir"""
+
+    def __init__(self, config: CorpusConfig, workdir: str | os.PathLike):
+        self.config = config
+        self.workdir = pathlib.Path(workdir)
+
+    @cached_property
+    def vocab(self) -> list[str]:
+        rng = random.Random(self.config.seed)
+        words = set()
+        while len(words) < self.config.vocab_size:
+            words.add("".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+        return sorted(words)
+
+    def _sentence(self, rng: random.Random, num_words: int) -> str:
+        # zipf-like word frequencies: low ranks are drawn far more often
+        words = [self.vocab[min(int(rng.paretovariate(1.0)) - 1, len(self.vocab) - 1)] for _ in range(num_words)]
+        return " ".join(words).capitalize() + "."
+
+    def _pii(self, rng: random.Random) -> str:
+        user = rng.choice(self.vocab)
+        return rng.choice([
+            f"Contact {user}@example.com for details.",
+            f"Call us at ({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)} today.",
+            f"The server runs at 10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)} now.",
+        ])
+
+    @cached_property
+    def docs(self) -> list[str]:
+        cfg = self.config
+        rng = random.Random(cfg.seed + 1)
+        docs = []
+        for _ in range(cfg.num_docs):
+            if docs and rng.random() < cfg.duplicate_fraction:
+                # near-duplicate: an earlier document with one line changed
+                lines = rng.choice(docs).split("\n")
+                lines[rng.randrange(len(lines))] = self._sentence(rng, 12)
+                docs.append("\n".join(lines))
+                continue
+            lines = [rng.choice(BOILERPLATE)]
+            remaining = cfg.words_per_doc
+            while remaining > 0:
+                num_words = min(remaining, rng.randint(5, 25))
+                lines.append(self._sentence(rng, num_words))
+                remaining -= num_words
+                if rng.random() < 0.05:
+                    lines.append(self._pii(rng))
+            lines.append(rng.choice(BOILERPLATE))
+            docs.append("\n".join(lines))
+        return docs
+
+    @cached_property
+    def num_bytes(self) -> int:
+        return sum(len(doc.encode("utf-8")) for doc in self.docs)
+
+    @cached_property
+    def html(self) -> list[bytes]:
+        pages = []
+        for i, doc in enumerate(self.docs):
+            lines = doc.split("\n")
+            body = "".join(f"<p>{line}</p>\n" for line in lines[1:-1])
+            pages.append((
+                f"<!DOCTYPE html><html><head><title>Page {i}</title></head><body>"
+                f"<nav><a href='/'>{lines[0]}</a></nav>\n<article>{body}</article>"
+                f"<footer>{lines[-1]}</footer></body></html>"
+            ).encode())
+        return pages
+
+    @cached_property
+    def text_files(self) -> list[pathlib.Path]:
+        doc_dir = self.workdir / "docs"
+        doc_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for i, doc in enumerate(self.docs):
+            path = doc_dir / f"doc_{i:06d}.txt"
+            path.write_text(doc, encoding="utf-8")
+            paths.append(path)
+        return paths
+
+    @cached_property
+    def warc_path(self) -> pathlib.Path:
+        path = self.workdir / "corpus.warc"
+        with open(path, "wb") as f:
+            for i, page in enumerate(self.html):
+                payload = (
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+                    + f"Content-Length: {len(page)}\r\n\r\n".encode() + page
+                )
+                header = (
+                    "WARC/1.0\r\nWARC-Type: response\r\n"
+                    f"WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-{i:012d}>\r\n"
+                    "WARC-Date: 2025-01-01T00:00:00Z\r\n"
+                    f"WARC-Target-URI: http://example.com/{i}\r\n"
+                    "Content-Type: application/http; msgtype=response\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n"
+                )
+                f.write(header.encode() + payload + b"\r\n\r\n")
+        return path
+
+    def output_dir(self, name: str) -> pathlib.Path:
+        path = self.workdir / "out" / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+# each benchmark prepares its (untimed) input and returns the timed callable,
+# the number of documents and the number of bytes it processes
+Benchmark = Callable[[Corpus], tuple[Callable[[], object], int, int]]
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str):
+    def register(fn: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+@benchmark("html2text")
+def _bench_html2text(corpus: Corpus):
+    from cs336_data.extractor import html2text
+
+    pages = corpus.html
+    return (lambda: [html2text(page) for page in pages]), len(pages), sum(map(len, pages))
+
+
+@benchmark("extract_warc")
+def _bench_extract_warc(corpus: Corpus):
+    from cs336_data.extractor import extract_texts_from_warc
+
+    path = corpus.warc_path
+    return (lambda: sum(1 for _ in extract_texts_from_warc(path))), len(corpus.docs), path.stat().st_size
+
+
+@benchmark("gopher_filter")
+def _bench_gopher_filter(corpus: Corpus):
+    from cs336_data.quality_filter import gopher_filter
+
+    docs = corpus.docs
+    return (lambda: [gopher_filter(doc) for doc in docs]), len(docs), corpus.num_bytes
+
+
+def _identifier_benchmark(fn_name: str, model_path: pathlib.Path) -> Benchmark:
+    def bench(corpus: Corpus):
+        if not model_path.exists():
+            raise SkipBenchmark(f"{model_path} not found")
+        from cs336_data import identifier
+
+        fn = getattr(identifier, fn_name)
+        docs = corpus.docs
+        fn(docs[0], model_path)  # model loading is not part of the measurement
+        return (lambda: [fn(doc, model_path) for doc in docs]), len(docs), corpus.num_bytes
+    return bench
+
+
+benchmark("language_identification")(_identifier_benchmark("language_identification", common.LANGUAGE_MODEL_PATH))
+benchmark("nsfw_detection")(_identifier_benchmark("nsfw_detection", common.NSFW_MODEL_PATH))
+benchmark("hate_detection")(_identifier_benchmark("hate_detection", common.HATE_MODEL_PATH))
+
+
+@benchmark("mask_all")
+def _bench_mask_all(corpus: Corpus):
+    from cs336_data.masker import mask_all
+
+    docs = corpus.docs
+    return (lambda: [mask_all(doc) for doc in docs]), len(docs), corpus.num_bytes
+
+
+@benchmark("exact_line_deduplication")
+def _bench_exact_line_deduplication(corpus: Corpus):
+    from cs336_data.deduplication import exact_line_deduplication
+
+    files, out_dir = corpus.text_files, corpus.output_dir("exact_line_deduplication")
+    return (lambda: exact_line_deduplication(files, out_dir)), len(files), corpus.num_bytes
+
+
+@benchmark("minhash_deduplication")
+def _bench_minhash_deduplication(corpus: Corpus):
+    from cs336_data.deduplication import minhash_deduplication
+
+    files, out_dir = corpus.text_files, corpus.output_dir("minhash_deduplication")
+    return (
+        lambda: minhash_deduplication(files, 100, 10, 5, 0.8, out_dir)
+    ), len(files), corpus.num_bytes
+
+
+@benchmark("perplexity_of_text")
+def _bench_perplexity_of_text(corpus: Corpus):
+    from cs336_data.ngram import CompactKneserNey
+    from cs336_data.train import perplexity_of_text
+
+    # tokenization is measured by gopher_filter; here only the scoring is timed
+    token_docs = [doc.split() for doc in corpus.docs]
+    model = CompactKneserNey.fit(token_docs[: max(1, len(token_docs) // 2)], 3)
+    return (lambda: [perplexity_of_text(model, tokens, 3) for tokens in token_docs]), len(token_docs), corpus.num_bytes
+
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+
+def run_benchmark(name: str, config: CorpusConfig, workdir: str | os.PathLike, repeat: int = 3) -> dict:
+    """time one benchmark on the corpus described by config; keeps the fastest of `repeat` runs"""
+    corpus = Corpus(config, workdir)
+    try:
+        fn, num_docs, num_bytes = BENCHMARKS[name](corpus)
+    except SkipBenchmark as e:
+        return {"skipped": str(e)}
+    rss_before = _max_rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    seconds = min(times)
+    return {
+        "docs": num_docs,
+        "bytes": num_bytes,
+        "seconds": seconds,
+        "mean_seconds": sum(times) / len(times),
+        "docs_per_sec": num_docs / seconds if seconds else float("inf"),
+        "mb_per_sec": num_bytes / 1e6 / seconds if seconds else float("inf"),
+        "peak_rss_mb": _max_rss_mb(),
+        "rss_growth_mb": _max_rss_mb() - rss_before,
+    }
+
+
+def _git_revision() -> dict[str, str | None]:
+    def git(*args: str) -> str | None:
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, check=True, cwd=pathlib.Path(__file__).parent
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD")}
+
+
+def run_benchmarks(
+    names: list[str] | None = None,
+    config: CorpusConfig | None = None,
+    repeat: int = 3,
+    isolate: bool = True,
+    workdir: str | os.PathLike | None = None,
+) -> dict:
+    """run the selected benchmarks (all by default) and return the results together with run metadata"""
+    config = config or CorpusConfig()
+    names = names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"unknown benchmarks: {sorted(unknown)}")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        for name in names:
+            logger.info(f"running {name}")
+            if isolate:
+                # a fresh interpreter per benchmark so that peak RSS is its own
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    results[name] = executor.submit(run_benchmark, name, config, workdir, repeat).result()
+            else:
+                results[name] = run_benchmark(name, config, workdir, repeat)
+            logger.info(f"{name}: {results[name]}")
+    return {
+        "meta": {
+            **_git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "isolated": isolate,
+            "corpus": asdict(config),
+        },
+        "results": results,
+    }
+
+
+# name -> (sketch, bits) as accepted by deduplication.make_signature
+SKETCH_MODES = {
+    "md5": ("md5", None),
+    "oph": ("oph", None),
+    "oph-32bit": ("oph", 32),
+    "oph-16bit": ("oph", 16),
+    "oph-8bit": ("oph", 8),
+}
+
+
+def sketch_accuracy(
+    config: CorpusConfig | None = None,
+    num_pairs: int = 100,
+    num_hashes: int = 128,
+    ngrams: int = 5,
+    modes: list[str] | None = None,
+) -> dict:
+    """
+    Jaccard estimation error of every sketch mode against the exact ngram Jaccard similarity,
+    on pairs of a synthetic document and a copy with a random fraction of its words replaced
+    (so the true similarities cover the whole [0, 1] range); also reports the signature size
+    and the time to compute one signature
+    """
+    from cs336_data.deduplication import get_ngrams, hash_ngrams, jaccard_similarity, make_signature
+    from cs336_data.sketches import estimate_jaccard
+
+    config = config or CorpusConfig(num_docs=num_pairs)
+    modes = modes or list(SKETCH_MODES)
+    rng = random.Random(config.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Corpus(config, tmp)
+        docs = corpus.docs[:num_pairs]
+        pairs = []
+        for doc in docs:
+            words = doc.split()
+            fraction = rng.random() * 0.5
+            mutated = [rng.choice(corpus.vocab) if rng.random() < fraction else word for word in words]
+            pairs.append((get_ngrams(doc, ngrams), get_ngrams(" ".join(mutated), ngrams)))
+    exact = np.array([jaccard_similarity(a, b) for a, b in pairs])
+    hashed = [(hash_ngrams(a), hash_ngrams(b)) for a, b in pairs]
+
+    results = {}
+    for mode in modes:
+        sketch, bits = SKETCH_MODES[mode]
+        start = time.perf_counter()
+        signatures = [
+            (make_signature(a, num_hashes, sketch, bits, ha), make_signature(b, num_hashes, sketch, bits, hb))
+            for (a, b), (ha, hb) in zip(pairs, hashed)
+        ]
+        seconds = time.perf_counter() - start
+        estimates = np.array([estimate_jaccard(sa, sb, bits) for sa, sb in signatures])
+        errors = estimates - exact
+        sample = signatures[0][0]
+        results[mode] = {
+            "mean_abs_error": float(np.mean(np.abs(errors))),
+            "rmse": float(np.sqrt(np.mean(errors**2))),
+            "max_abs_error": float(np.max(np.abs(errors))),
+            # md5 minhashes are 128-bit Python ints
+            "bytes_per_signature": sample.nbytes if isinstance(sample, np.ndarray) else 16 * len(sample),
+            "us_per_signature": seconds / (2 * len(pairs)) * 1e6,
+        }
+    return {"num_pairs": len(pairs), "num_hashes": num_hashes, "ngrams": ngrams, "modes": results}
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list[dict]:
+    """
+    throughput of current relative to baseline for every benchmark present in
+    both; a benchmark regressed if it is more than `tolerance` slower
+    """
+    rows = []
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if cur is None or "skipped" in base or "skipped" in cur:
+            continue
+        ratio = cur["docs_per_sec"] / base["docs_per_sec"]
+        rows.append({
+            "name": name,
+            "baseline_docs_per_sec": base["docs_per_sec"],
+            "current_docs_per_sec": cur["docs_per_sec"],
+            "speedup": ratio,
+            "rss_mb_change": cur["peak_rss_mb"] - base["peak_rss_mb"],
+            "regressed": ratio < 1 - tolerance,
+        })
+    if baseline["meta"].get("corpus") != current["meta"].get("corpus"):
+        logger.warning("baseline and current were run on different corpus configs")
+    return rows
+
+
+def _load(path: str | os.PathLike) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="run benchmarks and write the results as JSON")
+    run.add_argument("names", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    run.add_argument("--docs", type=int, default=CorpusConfig.num_docs)
+    run.add_argument("--words-per-doc", type=int, default=CorpusConfig.words_per_doc)
+    run.add_argument("--vocab-size", type=int, default=CorpusConfig.vocab_size)
+    run.add_argument("--duplicate-fraction", type=float, default=CorpusConfig.duplicate_fraction)
+    run.add_argument("--seed", type=int, default=CorpusConfig.seed)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--no-isolate", action="store_true", help="run everything in this process")
+    run.add_argument("--output", type=pathlib.Path, default=None)
+    cmp = sub.add_parser("compare", help="compare two result files")
+    cmp.add_argument("baseline", type=pathlib.Path)
+    cmp.add_argument("current", type=pathlib.Path)
+    cmp.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown")
+    sketches = sub.add_parser("sketches", help="accuracy and cost of the minhash sketch modes")
+    sketches.add_argument("--pairs", type=int, default=100)
+    sketches.add_argument("--num-hashes", type=int, default=128)
+    sketches.add_argument("--ngrams", type=int, default=5)
+    sketches.add_argument("--modes", nargs="*", choices=list(SKETCH_MODES), default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "run":
+        config = CorpusConfig(args.docs, args.words_per_doc, args.vocab_size, args.duplicate_fraction, args.seed)
+        report = run_benchmarks(args.names, config, args.repeat, isolate=not args.no_isolate)
+        text = json.dumps(report, indent=2)
+        if args.output is not None:
+            args.output.write_text(text)
+        else:
+            print(text)
+        return 0
+
+    if args.command == "sketches":
+        print(json.dumps(sketch_accuracy(None, args.pairs, args.num_hashes, args.ngrams, args.modes), indent=2))
+        return 0
+
+    rows = compare(_load(args.baseline), _load(args.current), args.tolerance)
+    print(f"{'benchmark':<28}{'baseline/s':>14}{'current/s':>14}{'speedup':>10}{'rss MB':>10}")
+    for row in rows:
+        flag = "  REGRESSED" if row["regressed"] else ""
+        print(
+            f"{row['name']:<28}{row['baseline_docs_per_sec']:>14.1f}{row['current_docs_per_sec']:>14.1f}"
+            f"{row['speedup']:>9.2f}x{row['rss_mb_change']:>+10.1f}{flag}"
+        )
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,5 +5,8 @@ LANGUAGE_MODEL_PATH = DATA_DIR / "classifiers" / "lid.176.bin"
 HATE_MODEL_PATH = DATA_DIR / "classifiers" / "jigsaw_fasttext_bigrams_hatespeech_final.bin"
 NSFW_MODEL_PATH = DATA_DIR / "classifiers" / "jigsaw_fasttext_bigrams_nsfw_final.bin"
 WIKI_PATH = DATA_DIR / "wiki"
+CC_PATH = DATA_DIR / "CC"
 TEST_PATH = DATA_DIR / "test_txts"
-ASSETS_PATH = pathlib.Path(__file__).parent / "assets"
\ No newline at end of file
+ASSETS_PATH = pathlib.Path(__file__).parent / "assets"
+NGRAM_MODEL_PATH = ASSETS_PATH / "ngram"
+QUALITY_MODEL_PATH = ASSETS_PATH / "quality_fasttext.bin"
\ No newline at end of file
@@ -1,46 +1,120 @@
 import os
-from collections import Counter, defaultdict
+import json
+import logging
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Hashable, Iterable, Iterator
+from dataclasses import dataclass
 import hashlib
-import nltk
-try:
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    nltk.download('punkt_tab')
-from nltk.tokenize import word_tokenize
-
-def exact_line_deduplication(input_files: list[os.PathLike], output_directory: os.PathLike):
+import mmh3
+import numpy as np
+from xopen import xopen
+from cs336_data.extractor import extract_texts_from_warc
+from cs336_data.features import DocumentFeatures, as_features
+from cs336_data.lsh_planner import LSHPlan, plan_lsh
+from cs336_data.profiling import PipelineStats
+from cs336_data.sketches import (
+    BIT_DTYPES,
+    SignatureMatrix,
+    b_bit_signature,
+    estimate_jaccard,
+    fold_signature,
+    one_permutation_signature,
+)
+from cs336_data.writer import AsyncWriter, copy_file
+
+logger = logging.getLogger(__name__)
+
+def exact_line_deduplication(
+    input_files: list[os.PathLike],
+    output_directory: os.PathLike,
+    stats: PipelineStats | None = None,
+    writer: AsyncWriter | None = None,
+):
     """
     Perform exact line deduplication on a set of input files.
     1. count the number of occurrences of each line in the input files
     2. useing hash to reduce memory
     3. rewrite each file with the unique lines
+    outputs go through `writer` (a background AsyncWriter owned by this call if not given)
     """
 
+    stats = stats if stats is not None else PipelineStats(log_interval=None)
+
     # 1. count the number of occurrences of each line in the input files
     line_counts = Counter()
     for input_file in input_files:
-        with open(input_file) as f:
-            for line in f:
-                # 2. useing hash to reduce memory
-                line_counts[hash(line.strip())] += 1 if line.strip() else 0
+        with stats.stage("count_lines", os.path.getsize(input_file)):
+            with open(input_file) as f:
+                for line in f:
+                    # 2. useing hash to reduce memory
+                    line_counts[hash(line.strip())] += 1 if line.strip() else 0
     
     # 3. rewrite each file with the unique lines
-    for input_file in input_files:
-        with open(input_file) as f:
-            with open(os.path.join(output_directory, os.path.basename(input_file)), "w") as out:
-                for line in f:
-                    if line.strip() and line_counts[hash(line.strip())] == 1:
-                        out.write(line)
+    own_writer = writer is None
+    writer = writer if writer is not None else AsyncWriter()
+    try:
+        for input_file in input_files:
+            with stats.stage("rewrite", os.path.getsize(input_file)):
+                with open(input_file) as f:
+                    kept = "".join(line for line in f if line.strip() and line_counts[hash(line.strip())] == 1)
+                writer.write_file(os.path.join(output_directory, os.path.basename(input_file)), kept)
+    finally:
+        if own_writer:
+            writer.close()
 
-def get_ngrams(text: str, ngrams: int) -> set[tuple[str, ...]]:
+def get_ngrams(text: str | DocumentFeatures, ngrams: int) -> set[tuple[str, ...]]:
     """generate ngrams set from text """
-    tokens = word_tokenize(text)
-    return set(tuple(tokens[i:i+ngrams]) for i in range(len(tokens)-ngrams+1))
+    return as_features(text).ngrams(ngrams)
 
 def jaccard_similarity(ngrams_s1: set[tuple[str, ...]], ngrams_s2: set[tuple[str, ...]]) -> float:
     """calculate jaccard similarity between two ngrams sets"""
     return len(ngrams_s1 & ngrams_s2) / len(ngrams_s1 | ngrams_s2)
 
+def hash_ngrams(ngs: set[tuple[str, ...]]) -> np.ndarray:
+    """compact form of an ngram set: sorted unique 64-bit hashes"""
+    hashes = np.fromiter((mmh3.hash64(" ".join(ngram))[0] for ngram in ngs), dtype=np.int64, count=len(ngs))
+    return np.unique(hashes.view(np.uint64))
+
+def hashed_jaccard_similarity(hashes1: np.ndarray, hashes2: np.ndarray) -> float:
+    """exact jaccard similarity of two `hash_ngrams` sets (up to 64-bit hash collisions)"""
+    if not len(hashes1) and not len(hashes2):
+        return 1.0
+    intersection = len(np.intersect1d(hashes1, hashes2, assume_unique=True))
+    return intersection / (len(hashes1) + len(hashes2) - intersection)
+
+class NgramSetCache:
+    """LRU of hashed ngram sets, bounded by the total size of the arrays"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._sets: OrderedDict[int, np.ndarray] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sets)
+
+    def put(self, key: int, hashes: np.ndarray):
+        if hashes.nbytes > self.max_bytes:
+            return
+        self._sets[key] = hashes
+        self.num_bytes += hashes.nbytes
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self._sets.popitem(last=False)
+            self.num_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get(self, key: int) -> np.ndarray | None:
+        hashes = self._sets.get(key)
+        if hashes is None:
+            self.misses += 1
+            return None
+        self._sets.move_to_end(key)
+        self.hits += 1
+        return hashes
+
 def get_signature( ngs: set[tuple[str, ...]], num_hashes: int) -> list[int]:
     """get signature from ngrams set"""
     signature = [float('inf') ] * num_hashes
@@ -50,6 +124,17 @@ def get_signature( ngs: set[tuple[str, ...]], num_hashes: int) -> list[int]:
             signature[i] = min(signature[i], hash_value)
     return signature
 
+def make_signature(
+    ngs: set[tuple[str, ...]], num_hashes: int, sketch: str = "md5", bits: int | None = None,
+    hashes: np.ndarray | None = None,
+) -> list[int] | np.ndarray:
+    """signature of an ngram set in one of the SKETCHES, optionally b-bit; hashes: `hash_ngrams(ngs)` if known"""
+    if sketch == "oph":
+        sgn = one_permutation_signature(hash_ngrams(ngs) if hashes is None else hashes, num_hashes)
+    else:
+        sgn = get_signature(ngs, num_hashes)
+    return sgn if bits is None else b_bit_signature(sgn, bits)
+
 def signature_similarity(sgn1: list[int], sgn2: list[int]) -> float:
     """calculate signature similarity between two signature"""
     assert len(sgn1) == len(sgn2)
@@ -59,98 +144,393 @@ def signature_similarity(sgn1: list[int], sgn2: list[int]) -> float:
             same_col_num += 1
     return same_col_num / len(sgn1)
 
-def get_bands(signature: list[int], num_bands: int) -> tuple[list[tuple[int, ...]], int]:
-    """get bands and band length from signature"""
-    bands = []
-    assert len(signature) % num_bands == 0
-    band_len = len(signature) // num_bands
-    for i in range(num_bands):
-        bands.append(tuple(signature[i*band_len:(i+1)*band_len]))
-    return bands, band_len
-    
-class LSH:
+def band_digests(signature, num_bands: int, rows_per_band: int | None = None) -> np.ndarray:
+    """one stable 64-bit digest per band (seeded by the band index, so equal bands in different positions differ)"""
+    # md5 minhashes are 128-bit: fold them to 64 bits
+    signature = fold_signature(signature)
+    if rows_per_band is None:
+        assert len(signature) % num_bands == 0
+        rows_per_band = len(signature) // num_bands
+    bands = np.ascontiguousarray(signature[: num_bands * rows_per_band]).reshape(num_bands, rows_per_band)
+    return np.array([mmh3.hash64(band.tobytes(), seed=i)[0] for i, band in enumerate(bands)], dtype=np.int64)
+
+
+class CompactLSH:
+    """
+    array-backed LSH: documents are int32 ids in insertion order, every band is
+    reduced to a 64-bit digest, and after `build` the buckets of each band are
+    CSR arrays (sorted digests -> offsets -> doc ids) built by sorting.
+    only buckets holding more than one document are kept, singletons never yield candidates,
+    and `bucket_of[doc, band]` (-1 for a singleton) makes a query a few array slices.
+    """
 
-    def __init__(self, num_bands: int):
+    def __init__(self, num_bands: int, rows_per_band: int | None = None, capacity: int = 1024):
         self.num_bands = num_bands
-        self.buckets = [ defaultdict(list) for _ in range(num_bands) ]
+        self.rows_per_band = rows_per_band
+        self.num_docs = 0
+        self._digests = np.empty((capacity, num_bands), dtype=np.int64)
+        self.keys: list[np.ndarray] = []
+        self.offsets: list[np.ndarray] = []
+        self.doc_ids: list[np.ndarray] = []
+        self.bucket_of = np.empty((0, num_bands), dtype=np.int32)
+
+    def insert(self, signature) -> int:
+        """add a document, returns its id"""
+        if self.num_docs == len(self._digests):
+            self._digests = np.resize(self._digests, (2 * len(self._digests), self.num_bands))
+        self._digests[self.num_docs] = band_digests(signature, self.num_bands, self.rows_per_band)
+        self.num_docs += 1
+        return self.num_docs - 1
+
+    @property
+    def digests(self) -> np.ndarray:
+        return self._digests[: self.num_docs]
+
+    def build(self):
+        """sort each band into CSR buckets; call once after all inserts"""
+        self.keys, self.offsets, self.doc_ids = [], [], []
+        self.bucket_of = np.full((self.num_docs, self.num_bands), -1, dtype=np.int32)
+        for band in range(self.num_bands):
+            column = self.digests[:, band]
+            order = np.argsort(column, kind="stable").astype(np.int32)
+            keys, inverse, counts = np.unique(column[order], return_inverse=True, return_counts=True)
+            shared = counts > 1
+            # renumber the shared buckets 0..k-1, singletons become -1
+            bucket = np.where(shared, np.cumsum(shared) - 1, -1)[inverse]
+            self.bucket_of[order, band] = bucket
+            self.keys.append(keys[shared])
+            self.offsets.append(np.r_[0, np.cumsum(counts[shared])].astype(np.int64))
+            self.doc_ids.append(order[bucket >= 0])
 
-    def insert(self, signature: set[tuple[str, ...]], doc_name: str):
-        """insert ngram into LSH"""
-        bands, _ = get_bands(signature, self.num_bands)
-        for i in range(self.num_bands):
-            self.buckets[i][hash(bands[i])].append(doc_name)
+    def query(self, doc_id: int) -> np.ndarray:
+        """ids of the other documents sharing a bucket with doc_id"""
+        found = []
+        for band, k in enumerate(self.bucket_of[doc_id].tolist()):
+            if k >= 0:
+                offsets = self.offsets[band]
+                found.append(self.doc_ids[band][offsets[k] : offsets[k + 1]])
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        candidates = np.unique(np.concatenate(found))
+        return candidates[candidates != doc_id]
 
-    def query(self, signature: list[int], file_name: str) -> set[str]:
-        """return similar documents names from ngrams set"""
-        bands, _ = get_bands(signature, self.num_bands)
-        candidates = set()
-        for i in range(self.num_bands):
-            for doc_name in self.buckets[i][hash(bands[i])]:
-                candidates.add(doc_name)
-        candidates.remove(file_name)
-        return candidates
+    def colliding(self) -> set[int]:
+        """documents that share at least one bucket with another document"""
+        if not self.doc_ids:
+            return set()
+        return set(np.unique(np.concatenate(self.doc_ids)).tolist())
+
+    @property
+    def nbytes(self) -> int:
+        buckets = sum(a.nbytes for arrays in (self.keys, self.offsets, self.doc_ids) for a in arrays)
+        return self.digests.nbytes + self.bucket_of.nbytes + buckets
 
 
 def minhash_deduplication(
         input_files: list[os.PathLike],
-        num_hashes: int,
-        num_bands: int,
+        num_hashes: int | None,
+        num_bands: int | None,
         ngrams: int,
         jaccard_threshold: float,
         output_directory: os.PathLike,
+        stats: PipelineStats | None = None,
+        writer: AsyncWriter | None = None,
+        output_mode: str | None = None,
+        verify: bool = False,
+        sketch: str = "md5",
+        bits: int | None = None,
+        max_false_positive: float | None = None,
+        max_false_negative: float | None = None,
 ):
     """
     File Content -> N-grams Set S := [s_1, s_2, ..., s_m] , s_1 := ("a", "b", "c")
     N-grams Set -> signature := [minhash(h_1, S), minhash(h_2, S), ..., minhash(h_k, S)]
     signature ~> jaccard similarity ( the proportion of columns with the same minhash value)
+
+    survivors are materialized in output_directory according to output_mode (see
+    `materialize_survivors`); returns their source paths
+    """
+
+    stats = stats if stats is not None else PipelineStats(log_interval=None)
+    result = minhash_deduplicate_records(
+        iter_file_records(input_files), num_hashes, num_bands, ngrams, jaccard_threshold, stats,
+        verify=verify, sketch=sketch, bits=bits,
+        max_false_positive=max_false_positive, max_false_negative=max_false_negative,
+    )
+    # each survivor comes from its own source path, inputs may live in different directories
+    survivors = result.kept_ids()
+    materialize_survivors(survivors, output_directory, output_mode, stats=stats, writer=writer)
+    return survivors
+
+
+SKETCHES = ("md5", "oph")
+
+
+@dataclass
+class DedupResult:
     """
+    ids: document ids in input order
+    keep: keep/drop bitmap aligned with ids
+    cluster: for every document the index of the kept document it duplicates (itself if kept)
+    plan: the planned band/row split, None if num_hashes and num_bands were both given
+    """
+    ids: list[Hashable]
+    keep: np.ndarray
+    cluster: np.ndarray
+    plan: LSHPlan | None = None
+
+    def kept_ids(self) -> list[Hashable]:
+        return [doc_id for doc_id, keep in zip(self.ids, self.keep) if keep]
 
-    lsh = LSH(num_bands)
+    def cluster_table(self) -> list[tuple[Hashable, Hashable]]:
+        """(document id, id of the kept representative) for every document"""
+        return [(doc_id, self.ids[rep]) for doc_id, rep in zip(self.ids, self.cluster)]
+
+
+def minhash_deduplicate_records(
+        records: Iterable[tuple[Hashable, str]],
+        num_hashes: int | None,
+        num_bands: int | None,
+        ngrams: int,
+        jaccard_threshold: float,
+        stats: PipelineStats | None = None,
+        verify: bool = False,
+        verify_cache_bytes: int = 256 << 20,
+        sketch: str = "md5",
+        bits: int | None = None,
+        spill_dir: str | os.PathLike | None = None,
+        max_false_positive: float | None = None,
+        max_false_negative: float | None = None,
+) -> DedupResult:
+    """
+    minhash + LSH deduplication over (id, text) records, e.g. `iter_jsonl_records`
+    or `iter_warc_records`; the text is dropped once its signature is computed.
+    documents are identified by position, so ids only need to be meaningful to the caller.
+    with num_bands=None the band/row split is planned for jaccard_threshold (see `plan_lsh`),
+    within num_hashes if given; with num_hashes=None and num_bands given, the rows per band
+    (and so num_hashes) are planned for that number of bands. max_false_positive and
+    max_false_negative are the error budgets of the plan.
+    with verify=True, candidates are confirmed by exact jaccard similarity of hashed ngram
+    sets: the set of every document is hashed in the same pass as its signature and spilled
+    to a temporary file (in spill_dir); once the LSH is built, the sets of the documents
+    with candidates are loaded into an LRU of verify_cache_bytes, and sets that do not fit
+    are read back from the spill file when a pair needs them.
+    sketch: "md5" (get_signature) or "oph" (one-permutation minhash, see `sketches`);
+    bits: keep only 8/16/32 bits per slot, similarities are corrected for chance agreement
+    """
+    if sketch not in SKETCHES:
+        raise ValueError(f"unknown sketch {sketch!r}, expected one of {SKETCHES}")
+    if bits is not None and bits not in BIT_DTYPES:
+        raise ValueError(f"bits must be one of {list(BIT_DTYPES)}, got {bits}")
+    stats = stats if stats is not None else PipelineStats(log_interval=None)
+    plan = None
+    if num_bands is None or num_hashes is None:
+        # plan whatever was not given: the split within num_hashes, or the rows for num_bands
+        plan = plan_lsh(
+            jaccard_threshold, num_hashes, num_bands=num_bands,
+            max_false_positive=max_false_positive, max_false_negative=max_false_negative,
+        )
+        logger.info(f"LSH plan: {plan.report()}")
+        num_hashes = num_hashes or plan.num_hashes
+        lsh = CompactLSH(plan.num_bands, plan.rows_per_band)
+    else:
+        if max_false_positive is not None or max_false_negative is not None:
+            raise ValueError("error budgets need num_hashes or num_bands to be None so that the split is planned")
+        if not 1 <= num_bands <= num_hashes:
+            raise ValueError(f"num_bands must be in [1, num_hashes={num_hashes}], got {num_bands}")
+        lsh = CompactLSH(num_bands)
 
     # First pass: insert all ngrams into LSH
-    signatures = {}
-    for input_file in input_files:
-        file_name = os.path.basename(input_file)
-        with open(input_file) as f:
-            # generate ngrams set from file
-            ngs = get_ngrams(f.read(), ngrams)
-            sgn = get_signature(ngs, num_hashes)
-            signatures[file_name] = sgn
-            lsh.insert(sgn, file_name)
+    ids = []
+    if sketch == "md5" and bits is None:
+        signatures = []
+    else:
+        signatures = SignatureMatrix(num_hashes, BIT_DTYPES[bits or 64])
+    # hashed ngram sets of all documents, back to back; document i is spilled[offsets[i]:offsets[i + 1]]
+    spill = tempfile.TemporaryFile(dir=spill_dir) if verify else None
+    offsets = [0]
+    for doc_id, text in records:
+        with stats.stage("signature", len(text)):
+            # generate ngrams set from text
+            ngs = get_ngrams(text, ngrams)
+            hashes = hash_ngrams(ngs) if sketch == "oph" or spill is not None else None
+            sgn = make_signature(ngs, num_hashes, sketch, bits, hashes)
+            lsh.insert(sgn)
+            if spill is not None:
+                spill.write(hashes.tobytes())
+                offsets.append(offsets[-1] + len(hashes))
+        ids.append(doc_id)
+        signatures.append(sgn)
+
+    lsh.build()
+    logger.info(f"LSH built over {len(signatures)} documents ({lsh.nbytes / 1e6:.1f}MB)")
+    if plan is not None:
+        # pair similarities assumed uniform, pessimistic for web text where most pairs are near 0
+        expected = plan.expected_candidate_pairs(len(ids))
+        logger.info(f"LSH plan: {expected:.0f} expected candidate pairs among {len(ids)} documents")
+    cache = None
+    if spill is not None:
+        spill.flush()
+        spilled = np.memmap(spill, dtype=np.uint64, mode="r") if offsets[-1] else np.empty(0, dtype=np.uint64)
+        logger.info(f"spilled ngram sets: {spilled.nbytes / 1e6:.1f}MB")
+        cache = NgramSetCache(verify_cache_bytes)
+        # only documents with candidates are ever compared; load as many of their sets as fit
+        for i in sorted(lsh.colliding()):
+            if cache.num_bytes + (offsets[i + 1] - offsets[i]) * 8 > cache.max_bytes:
+                break
+            cache.put(i, np.array(spilled[offsets[i] : offsets[i + 1]]))
+        logger.info(f"verification cache: {len(cache)} ngram sets, {cache.num_bytes / 1e6:.1f}MB")
 
-    # print("LSH built")
+    def ngram_set(i: int) -> np.ndarray:
+        hashes = cache.get(i)
+        if hashes is None:
+            # evicted or never loaded: read it back from the spill file
+            hashes = np.array(spilled[offsets[i] : offsets[i + 1]])
+            cache.put(i, hashes)
+        return hashes
+
+    def similar(i: int, j: int) -> bool:
+        if cache is not None:
+            return hashed_jaccard_similarity(ngram_set(i), ngram_set(j)) > jaccard_threshold
+        if isinstance(signatures, list):
+            return signature_similarity(signatures[i], signatures[j]) > jaccard_threshold
+        return estimate_jaccard(signatures[i], signatures[j], bits) > jaccard_threshold
 
     # Second pass: find the similar candidates
-    unique_docs = []
+    keep = np.zeros(len(ids), dtype=bool)
+    cluster = np.full(len(ids), -1, dtype=np.int64)
     seen = set()
-    for input_file in input_files:
-        file_name = os.path.basename(input_file)
-        # is this file already been seen(similar to some other file)
-        if file_name in seen:
-            continue
-        sgn = signatures[file_name]
-        candidates: set[str] = lsh.query(sgn, file_name)
-        # if no similar documents, add itself to unique_docs
-        if not candidates:
-            unique_docs.append(file_name)
+    for i in range(len(ids)):
+        start = time.perf_counter()
+        # is this document already been seen(similar to some other document)
+        if i in seen:
+            stats.record("query", time.perf_counter() - start, docs_out=0)
             continue
+        keep[i] = True
+        cluster[i] = i
+        for candidate in lsh.query(i).tolist():
+            if similar(i, candidate):
+                seen.add(candidate)
+                if cluster[candidate] < 0:
+                    cluster[candidate] = i
+        stats.record("query", time.perf_counter() - start)
 
-        for candidate in candidates:
-                unique_docs.append(file_name)
-                file_sgn = signatures[file_name]
-                candidate_sgn = signatures[candidate]
-                if signature_similarity(file_sgn, candidate_sgn) > jaccard_threshold:
-                    seen.add(candidate)
+    logger.info(f"unique_docs: {int(keep.sum())}")
+    if cache is not None:
+        logger.info(
+            f"verification cache: {cache.hits} hits, {cache.misses} reads from the spill file, "
+            f"{cache.evictions} evictions"
+        )
+        del spilled
+        spill.close()
+    return DedupResult(ids, keep, cluster, plan)
 
-    # print(f"unique_docs: {len(unique_docs)}")
 
-    # write unique_docs to output_directory
-    input_directory = os.path.dirname(input_files[0])
-    for unique_file in unique_docs:
-        file_path = os.path.join(input_directory, unique_file)
-        with open(file_path) as f:
-            with open(os.path.join(output_directory, unique_file), "w") as out:
-                out.write(f.read())
+def iter_file_records(paths: Iterable[os.PathLike]) -> Iterator[tuple[os.PathLike, str]]:
+    """one record per text file, identified by its path"""
+    for path in paths:
+        with open(path) as f:
+            yield path, f.read()
+
+
+def iter_jsonl_records(
+        paths: Iterable[os.PathLike], id_field: str | None = "id", text_field: str = "text"
+) -> Iterator[tuple[Hashable, str]]:
+    """records of (optionally compressed) JSONL shards; without an id field the id is (path, line number)"""
+    for path in paths:
+        with xopen(path) as f:
+            for line_no, line in enumerate(f):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                doc_id = row[id_field] if id_field is not None and id_field in row else (os.fspath(path), line_no)
+                yield doc_id, row[text_field]
+
+
+def iter_parquet_records(
+        paths: Iterable[os.PathLike], id_field: str | None = "id", text_field: str = "text", batch_size: int = 1024
+) -> Iterator[tuple[Hashable, str]]:
+    """records of Parquet shards, read in batches; needs pyarrow"""
+    import pyarrow.parquet as pq
+
+    for path in paths:
+        parquet_file = pq.ParquetFile(path)
+        has_id = id_field is not None and id_field in parquet_file.schema_arrow.names
+        columns = [id_field, text_field] if has_id else [text_field]
+        row = 0
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            texts = batch.column(text_field).to_pylist()
+            if has_id:
+                doc_ids = batch.column(id_field).to_pylist()
+            else:
+                doc_ids = [(os.fspath(path), row + i) for i in range(len(texts))]
+            yield from zip(doc_ids, texts)
+            row += len(texts)
+
+
+def iter_warc_records(warc_paths: Iterable[os.PathLike]) -> Iterator[tuple[tuple[str, int], str]]:
+    """extracted texts of WARC files, identified by (path, index of the extracted document)"""
+    for path in warc_paths:
+        for i, text in enumerate(extract_texts_from_warc(path)):
+            yield (os.fspath(path), i), text
+
+
+OUTPUT_MODES = ("copy", "write", "hardlink", "symlink", "manifest")
+
+
+def materialize_survivors(
+    survivors: list[os.PathLike],
+    output_directory: os.PathLike,
+    output_mode: str | None = None,
+    stats: PipelineStats | None = None,
+    writer: AsyncWriter | None = None,
+    manifest_name: str = "survivors.txt",
+):
+    """
+    put the documents that survived deduplication into output_directory, under their basenames
+    - copy: in-kernel copy (copy_file_range / sendfile), the bytes never pass through Python
+    - write: read and re-write through writer (e.g. to compress the outputs), or a private AsyncWriter
+    - hardlink / symlink: link to the source file, no data is copied
+    - manifest: only write the absolute source paths, one per line, to output_directory/manifest_name
+    output_mode defaults to "write" when a writer is given and "copy" otherwise; a writer
+    together with any other mode is an error, since it would be silently ignored
+    """
+    if output_mode is None:
+        output_mode = "copy" if writer is None else "write"
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"unknown output_mode {output_mode!r}, expected one of {OUTPUT_MODES}")
+    if writer is not None and output_mode != "write":
+        raise ValueError(f"a writer is only used with output_mode='write', got {output_mode!r}")
+    stats = stats if stats is not None else PipelineStats(log_interval=None)
+    names = Counter(os.path.basename(path) for path in survivors)
+    collisions = [name for name, count in names.items() if count > 1]
+    if collisions and output_mode != "manifest":
+        raise ValueError(f"survivors from different directories share basenames: {collisions[:5]}")
+    if output_mode == "manifest":
+        with stats.stage("write"):
+            with open(os.path.join(output_directory, manifest_name), "w") as f:
+                f.writelines(f"{os.path.abspath(path)}\n" for path in survivors)
+        return
+
+    own_writer = output_mode == "write" and writer is None
+    if own_writer:
+        writer = AsyncWriter()
+    try:
+        for source in survivors:
+            target = os.path.join(output_directory, os.path.basename(source))
+            with stats.stage("write", os.path.getsize(source)):
+                if output_mode == "copy":
+                    copy_file(source, target)
+                elif output_mode == "write":
+                    with open(source, "rb") as f:
+                        writer.write_file(target, f.read())
+                elif output_mode == "hardlink":
+                    os.link(source, target)
+                else:
+                    os.symlink(os.path.abspath(source), target)
+    finally:
+        if own_writer:
+            writer.close()
 
 
 if __name__ == "__main__":
@@ -166,8 +546,7 @@ if __name__ == "__main__":
 
     sign1 = get_signature(ngs1, 10)
     print(sign1)
-    bands1, bd1_len = get_bands(sign1, 5)
-    print(bands1)
+    print(band_digests(sign1, 5))
 
     print("==="*10)
 
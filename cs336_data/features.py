@@ -0,0 +1,82 @@
+"""
+Per-document features shared by the filters.
+
+Every filter stage used to recompute what it needs from the raw text
+(word_tokenize in gopher_filter, classify_quality and get_ngrams, newline
+normalization in every identifier call). A DocumentFeatures object computes
+each of these lazily, at most once, and every stage that accepts a
+`str | DocumentFeatures` reuses them.
+"""
+
+from __future__ import annotations
+
+from functools import cached_property
+
+import nltk
+try:
+    nltk.data.find('tokenizers/punkt_tab')
+except LookupError:
+    nltk.download('punkt_tab')
+from nltk.tokenize import word_tokenize
+
+
+class DocumentFeatures:
+    def __init__(self, text: str):
+        self.text = text
+        self._ngrams: dict[int, set[tuple[str, ...]]] = {}
+
+    @cached_property
+    def tokens(self) -> list[str]:
+        """nltk word tokens"""
+        return word_tokenize(self.text)
+
+    @cached_property
+    def lines(self) -> list[str]:
+        return self.text.splitlines()
+
+    @cached_property
+    def non_empty_lines(self) -> list[str]:
+        """stripped lines that are not blank"""
+        return [line.strip() for line in self.lines if line.strip()]
+
+    @cached_property
+    def single_line(self) -> str:
+        """newlines replaced by spaces, as fastText expects"""
+        return self.text.replace("\n", " ").strip()
+
+    @cached_property
+    def collapsed(self) -> str:
+        """all whitespace runs collapsed into single spaces"""
+        return " ".join(self.text.split())
+
+    @cached_property
+    def num_bytes(self) -> int:
+        return len(self.text.encode("utf-8"))
+
+    @cached_property
+    def char_stats(self) -> dict[str, int]:
+        """number of characters, alphabetic, digit, whitespace and non-ascii characters"""
+        text = self.text
+        return {
+            "chars": len(text),
+            "alpha": sum(map(str.isalpha, text)),
+            "digit": sum(map(str.isdigit, text)),
+            "space": sum(map(str.isspace, text)),
+            "non_ascii": len(text) - len(text.encode("ascii", errors="ignore")),
+        }
+
+    @cached_property
+    def mean_word_length(self) -> float:
+        return sum(len(token) for token in self.tokens) / len(self.tokens) if self.tokens else 0.0
+
+    def ngrams(self, n: int) -> set[tuple[str, ...]]:
+        """set of word n-grams"""
+        if n not in self._ngrams:
+            tokens = self.tokens
+            self._ngrams[n] = set(tuple(tokens[i:i+n]) for i in range(len(tokens)-n+1))
+        return self._ngrams[n]
+
+
+def as_features(doc: str | DocumentFeatures) -> DocumentFeatures:
+    """wrap raw text, pass features through"""
+    return doc if isinstance(doc, DocumentFeatures) else DocumentFeatures(doc)
@@ -1,40 +1,68 @@
 from cs336_data.extractor import extract_texts_from_warc
+import argparse
+import logging
 import pathlib
 import time
 from collections.abc import Generator
 from cs336_data.common import DATA_DIR, WIKI_PATH
+from cs336_data.features import DocumentFeatures
 from cs336_data.identifier import language_identification, nsfw_detection, hate_detection
 from cs336_data.masker import mask_all
+from cs336_data.profiling import PipelineStats, profile
 from cs336_data.quality_filter import gopher_filter
+from cs336_data.writer import AsyncWriter
 
-def data_generator(warc_path: str | pathlib.Path) -> Generator[str, None, None]:
-    for item in extract_texts_from_warc(warc_path):
-        if gopher_filter(item):
+def data_generator(warc_path: str | pathlib.Path, stats: PipelineStats | None = None) -> Generator[str, None, None]:
+    # per-stage wall time, documents in/out and bytes; no periodic logging unless the caller asks for it
+    stats = stats if stats is not None else PipelineStats(log_interval=None)
+    for item in stats.iterate("extract", extract_texts_from_warc(warc_path), nbytes=len):
+        # tokens, line splits and the single-line text are computed once and shared by every stage
+        doc = DocumentFeatures(item)
+        nbytes = doc.num_bytes
+        with stats.stage("gopher", nbytes) as stage:
+            if gopher_filter(doc):
+                stage.passed = False
+        if not stage.passed:
             continue
-        language, lang_score = language_identification(item)
-        if language != "en":
+        with stats.stage("langid", nbytes) as stage:
+            language, lang_score = language_identification(doc)
+            stage.passed = language == "en" and lang_score >= 0.9
+        if not stage.passed:
             continue
-        elif lang_score < 0.9:
+        with stats.stage("nsfw", nbytes) as stage:
+            nsfw, nsfw_score = nsfw_detection(doc)
+            stage.passed = nsfw == "non-nsfw" and nsfw_score >= 0.95
+        if not stage.passed:
             continue
-        nsfw, nsfw_score = nsfw_detection(item)
-        if nsfw != "non-nsfw":
+        with stats.stage("hate", nbytes) as stage:
+            hate, hate_score = hate_detection(doc)
+            stage.passed = hate == "non-toxic" and hate_score >= 0.95
+        if not stage.passed:
             continue
-        elif nsfw_score < 0.95:
-            continue
-        hate, hate_score = hate_detection(item)
-        if hate != "non-toxic":
-            continue
-        elif hate_score < 0.95:
-            continue
-        result = mask_all(item)
+        with stats.stage("mask", nbytes):
+            result = mask_all(item)
         yield result["text"]
 
 if __name__ == "__main__":
-    for item in data_generator(DATA_DIR / "data_20.warc.gz"):
-        # write to WIKI_PATH
-        now = time.strftime('%Y%m%d%H%M%S')
-        with open(WIKI_PATH / f"data_{now}.txt", "w") as f:
-            f.write(item)
-
-    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--warc", type=pathlib.Path, default=DATA_DIR / "data_20.warc.gz")
+    parser.add_argument("--output-dir", type=pathlib.Path, default=WIKI_PATH)
+    parser.add_argument("--log-interval", type=float, default=30.0, help="seconds between progress log lines")
+    parser.add_argument("--stats-json", type=pathlib.Path, default=None, help="write a per-stage JSON summary here")
+    parser.add_argument("--profile", type=pathlib.Path, default=None, help="write cProfile stats here")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None)
+    parser.add_argument("--fsync-every", type=int, default=0, help="fsync in batches of this many files (0: never)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
+    stats = PipelineStats(log_interval=args.log_interval)
+    # writes happen on a background thread; the "write" stage only measures the hand-off
+    with profile(args.profile), AsyncWriter(args.compression, fsync_every=args.fsync_every) as writer:
+        for i, item in enumerate(data_generator(args.warc, stats)):
+            # write to WIKI_PATH
+            with stats.stage("write", len(item.encode("utf-8"))):
+                now = time.strftime('%Y%m%d%H%M%S')
+                writer.write_file(args.output_dir / f"data_{now}_{i}.txt", item)
+    stats.log()
+    if args.stats_json is not None:
+        stats.write_json(args.stats_json)
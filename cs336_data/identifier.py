@@ -1,38 +1,84 @@
 import fasttext
+import functools
 import pathlib
+from collections.abc import Sequence
 from cs336_data.common import LANGUAGE_MODEL_PATH, DATA_DIR, HATE_MODEL_PATH, NSFW_MODEL_PATH
 from cs336_data.extractor import extract_texts_from_warc
+from cs336_data.features import DocumentFeatures
 
-def language_identification(text: str, model_path: str | pathlib.Path = LANGUAGE_MODEL_PATH):
+@functools.cache
+def load_model(model_path: str):
+    """load a fastText model once per process"""
+    return fasttext.load_model(model_path)
+
+def normalize_text(text: str | DocumentFeatures) -> str:
+    """fastText predicts on a single line"""
+    if isinstance(text, DocumentFeatures):
+        return text.single_line
+    return text.replace("\n", " ").strip() # remove '\n'
+
+def predict(text: str | DocumentFeatures, model_path: str | pathlib.Path) -> tuple[str, float]:
+    """top label (without the __label__ prefix) and its probability"""
+    result = load_model(str(model_path)).predict(normalize_text(text))
+    return result[0][0][9:], result[1][0]
+
+def predict_batch(texts: Sequence[str | DocumentFeatures], model_path: str | pathlib.Path) -> list[tuple[str, float]]:
+    """predict many texts with one call into fastText"""
+    if not texts:
+        return []
+    labels, scores = load_model(str(model_path)).predict([normalize_text(text) for text in texts])
+    return [(label[0][9:], float(score[0])) for label, score in zip(labels, scores)]
+
+def predict_probs_batch(
+    texts: Sequence[str | DocumentFeatures], model_path: str | pathlib.Path
+) -> list[dict[str, float]]:
+    """probability of every label (without the __label__ prefix) for many texts"""
+    if not texts:
+        return []
+    labels, scores = load_model(str(model_path)).predict([normalize_text(text) for text in texts], k=-1)
+    return [
+        {label[9:]: float(score) for label, score in zip(text_labels, text_scores)}
+        for text_labels, text_scores in zip(labels, scores)
+    ]
+
+def language_identification(text: str | DocumentFeatures, model_path: str | pathlib.Path = LANGUAGE_MODEL_PATH):
     """
     take a unicode string and return a pair containing an identifier of the language
     and a confidence score
     """
+    return predict(text, model_path)
 
-    model = fasttext.load_model(str(model_path))
-    processed_text = text.replace("\n", " ").strip() # remove '\n'
-    result = model.predict(processed_text)
-    return result[0][0][9:], result[1][0]
-
-def nsfw_detection(text: str, model_path: str | pathlib.Path = NSFW_MODEL_PATH):
+def nsfw_detection(text: str | DocumentFeatures, model_path: str | pathlib.Path = NSFW_MODEL_PATH):
     """
     take a unicode string and return a pair containing an identifier of the language
     and a confidence score
     """
-    model = fasttext.load_model(str(model_path))
-    processed_text = text.replace("\n", " ").strip() # remove '\n'
-    result = model.predict(processed_text)
-    return result[0][0][9:], result[1][0]
+    return predict(text, model_path)
 
-def hate_detection(text: str, model_path: str | pathlib.Path = HATE_MODEL_PATH):
+def hate_detection(text: str | DocumentFeatures, model_path: str | pathlib.Path = HATE_MODEL_PATH):
     """
     take a unicode string and return a pair containing an identifier of the language
     and a confidence score
     """
-    model = fasttext.load_model(str(model_path))
-    processed_text = text.replace("\n", " ").strip() # remove '\n'
-    result = model.predict(processed_text)
-    return result[0][0][9:], result[1][0]
+    return predict(text, model_path)
+
+def language_identification_batch(
+    texts: Sequence[str | DocumentFeatures], model_path: str | pathlib.Path = LANGUAGE_MODEL_PATH
+):
+    """batched language_identification"""
+    return predict_batch(texts, model_path)
+
+def nsfw_detection_batch(
+    texts: Sequence[str | DocumentFeatures], model_path: str | pathlib.Path = NSFW_MODEL_PATH
+):
+    """batched nsfw_detection"""
+    return predict_batch(texts, model_path)
+
+def hate_detection_batch(
+    texts: Sequence[str | DocumentFeatures], model_path: str | pathlib.Path = HATE_MODEL_PATH
+):
+    """batched hate_detection"""
+    return predict_batch(texts, model_path)
 
 if __name__ == "__main__":
     i = 0
@@ -0,0 +1,139 @@
+"""
+Pick the LSH band/row split for a target Jaccard threshold.
+
+With b bands of r rows, two documents of Jaccard similarity s become a
+candidate pair with probability P(s) = 1 - (1 - s^r)^b (the S-curve).
+Averaging it on either side of the threshold t gives the two error rates
+(for pair similarities spread uniformly over each side)
+
+    false positive rate = 1/t     * integral_0^t P(s) ds
+    false negative rate = 1/(1-t) * integral_t^1 (1 - P(s)) ds
+
+`plan_lsh` evaluates every (b, r) with b * r <= the hash budget at once (or
+every r for a fixed b) and returns the cheapest split within the given error
+budgets, or the one with the smallest weighted error when no budget is given.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GRID_SIZE = 1001
+
+
+def candidate_probability(similarity: np.ndarray | float, num_bands, rows_per_band) -> np.ndarray:
+    """probability that a pair with the given Jaccard similarity shares at least one band"""
+    return 1 - (1 - np.power(similarity, rows_per_band)) ** num_bands
+
+
+def _error_areas(threshold: float, bands: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """false positive and false negative rates of every (bands[i], rows[i]) split"""
+    below = np.linspace(0, threshold, GRID_SIZE)
+    above = np.linspace(threshold, 1, GRID_SIZE)
+    p_below = candidate_probability(below[None, :], bands[:, None], rows[:, None])
+    p_above = candidate_probability(above[None, :], bands[:, None], rows[:, None])
+    fp = np.trapz(p_below, below, axis=1) / threshold
+    fn = np.trapz(1 - p_above, above, axis=1) / (1 - threshold)
+    return fp, fn
+
+
+@dataclass(frozen=True)
+class LSHPlan:
+    threshold: float
+    num_bands: int
+    rows_per_band: int
+    false_positive: float
+    false_negative: float
+
+    @property
+    def num_hashes(self) -> int:
+        """minhash values actually used by the bands"""
+        return self.num_bands * self.rows_per_band
+
+    def candidate_probability(self, similarity):
+        return candidate_probability(similarity, self.num_bands, self.rows_per_band)
+
+    def expected_candidate_pairs(self, num_docs: int, pair_similarities: np.ndarray | None = None) -> float:
+        """
+        expected number of candidate pairs among num_docs documents; pair_similarities is a
+        sample of the Jaccard similarities of random document pairs (uniform on [0, 1] if not given,
+        which is pessimistic for web text where almost all pairs are near 0)
+        """
+        num_pairs = num_docs * (num_docs - 1) / 2
+        if pair_similarities is None:
+            t = self.threshold
+            return num_pairs * (self.false_positive * t + (1 - self.false_negative) * (1 - t))
+        return num_pairs * float(np.mean(self.candidate_probability(np.asarray(pair_similarities))))
+
+    def report(self, num_docs: int | None = None, pair_similarities: np.ndarray | None = None) -> dict:
+        result = {
+            "threshold": self.threshold,
+            "num_bands": self.num_bands,
+            "rows_per_band": self.rows_per_band,
+            "num_hashes": self.num_hashes,
+            "false_positive": self.false_positive,
+            "false_negative": self.false_negative,
+            # similarity at which a pair becomes a candidate with probability 1/2
+            "effective_threshold": (1 - 0.5 ** (1 / self.num_bands)) ** (1 / self.rows_per_band),
+        }
+        if num_docs is not None:
+            result["expected_candidate_pairs"] = self.expected_candidate_pairs(num_docs, pair_similarities)
+        return result
+
+
+def plan_lsh(
+    threshold: float,
+    num_hashes: int | None = None,
+    max_hashes: int = 256,
+    num_bands: int | None = None,
+    max_false_positive: float | None = None,
+    max_false_negative: float | None = None,
+    false_positive_weight: float = 0.5,
+    false_negative_weight: float = 0.5,
+) -> LSHPlan:
+    """
+    choose (num_bands, rows_per_band) for the Jaccard threshold.
+
+    num_hashes: fixed signature length; otherwise every length up to max_hashes is considered
+    num_bands: fixed number of bands, only rows_per_band is chosen (and with it num_hashes)
+    max_false_positive / max_false_negative: error rate budgets; among the splits that meet both,
+        the one with the fewest hashes (cheapest signatures) wins, ties broken by weighted error.
+        Without budgets (or if nothing meets them) the weighted error is minimized.
+    """
+    if not 0 < threshold < 1:
+        raise ValueError(f"threshold must be in (0, 1), got {threshold}")
+    limit = num_hashes if num_hashes is not None else max_hashes
+    if num_bands is not None:
+        if not 1 <= num_bands <= limit:
+            raise ValueError(f"num_bands must be in [1, {limit}] for a budget of {limit} hashes, got {num_bands}")
+        splits = [(num_bands, r) for r in range(1, limit // num_bands + 1)]
+    else:
+        splits = [(b, r) for r in range(1, limit + 1) for b in range(1, limit // r + 1)]
+    bands = np.array([b for b, _ in splits])
+    rows = np.array([r for _, r in splits])
+    fp, fn = _error_areas(threshold, bands, rows)
+    error = false_positive_weight * fp + false_negative_weight * fn
+
+    budgeted = max_false_positive is not None or max_false_negative is not None
+    feasible = np.ones(len(splits), dtype=bool)
+    if max_false_positive is not None:
+        feasible &= fp <= max_false_positive
+    if max_false_negative is not None:
+        feasible &= fn <= max_false_negative
+    if budgeted and feasible.any():
+        # lexicographic: fewest hashes, then smallest weighted error
+        candidates = np.flatnonzero(feasible)
+        best = candidates[np.lexsort((error[candidates], (bands * rows)[candidates]))[0]]
+    else:
+        if budgeted:
+            logger.warning(
+                f"no band/row split with at most {limit} hashes meets the error budgets "
+                f"(fp <= {max_false_positive}, fn <= {max_false_negative}); minimizing the weighted error"
+            )
+        best = int(np.argmin(error))
+    return LSHPlan(threshold, int(bands[best]), int(rows[best]), float(fp[best]), float(fn[best]))
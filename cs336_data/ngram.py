@@ -0,0 +1,368 @@
+"""
+Compact interpolated Kneser-Ney n-gram language model.
+
+Everything lives in flat NumPy arrays so that the model is small on disk, cheap
+to query, and can be shared between processes:
+- tokens are mapped to ids through a sorted array of 64-bit token hashes
+  (id = position in the array, unknown tokens get id ``vocab_size``)
+- every k-gram is packed into one int64 key, ``63 // n`` bits per id
+- for each order the keys are sorted, so lookups are ``np.searchsorted``
+- continuation counts and per-context totals/types are precomputed
+
+A saved model is a directory of ``.npy`` files plus ``meta.json``. ``load``
+opens the arrays with ``mmap_mode="r"`` so that many workers using the same
+model share one copy through the page cache.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+from collections.abc import Iterable, Sequence
+
+import mmh3
+import numpy as np
+
+BOS = "<s>"
+EOS = "</s>"
+
+
+def token_hash(token: str) -> int:
+    """stable signed 64-bit hash of a token"""
+    return mmh3.hash64(token, signed=True)[0]
+
+
+def hash_tokens(tokens: Sequence[str]) -> np.ndarray:
+    """hash a token list into an int64 array"""
+    return np.fromiter((token_hash(t) for t in tokens), dtype=np.int64, count=len(tokens))
+
+
+def id_bits(n: int) -> int:
+    """number of bits used for one token id in a packed n-gram key"""
+    return 63 // n
+
+
+def pad_tokens(tokens: Sequence[str], n: int) -> list[str]:
+    """same padding as nltk.lm.preprocessing.pad_both_ends"""
+    return [BOS] * (n - 1) + list(tokens) + [EOS] * (n - 1)
+
+
+def encode_tokens(vocab: np.ndarray, tokens: Sequence[str]) -> np.ndarray:
+    """map tokens to ids in a sorted hash vocabulary, unknown tokens map to len(vocab)"""
+    idx, found = _find(vocab, hash_tokens(tokens))
+    return np.where(found, idx, len(vocab)).astype(np.int64)
+
+
+def pack_ngrams(ids: np.ndarray, order: int, bits: int) -> np.ndarray:
+    """pack every `order`-gram of a 1-d id array into int64 keys"""
+    num = len(ids) - order + 1
+    if num <= 0:
+        return np.empty(0, dtype=np.int64)
+    keys = np.zeros(num, dtype=np.int64)
+    for j in range(order):
+        keys = (keys << bits) | ids[j : j + num]
+    return keys
+
+
+def pack_columns(grams: np.ndarray, bits: int) -> np.ndarray:
+    """pack the rows of a (m, k) id matrix into int64 keys"""
+    keys = np.zeros(len(grams), dtype=np.int64)
+    for j in range(grams.shape[1]):
+        keys = (keys << bits) | grams[:, j]
+    return keys
+
+
+def merge_counts(*tables: tuple[np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """merge (keys, counts) tables into one sorted table with unique keys"""
+    tables = [t for t in tables if len(t[0])]
+    if not tables:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys = np.concatenate([k for k, _ in tables])
+    counts = np.concatenate([c for _, c in tables])
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts).astype(np.int64)
+
+
+def count_ngrams(id_docs: Iterable[np.ndarray], n: int) -> tuple[np.ndarray, np.ndarray]:
+    """count the n-grams of already padded id documents"""
+    bits = id_bits(n)
+    keys = [pack_ngrams(ids, n, bits) for ids in id_docs]
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+    unique, counts = np.unique(keys, return_counts=True)
+    return unique, counts.astype(np.int64)
+
+
+def count_hashed_ngrams(token_docs: Iterable[Sequence[str]], n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    count the n-grams of token lists as rows of token hashes; unlike packed
+    ids these tables need no shared vocabulary, so they can be built by
+    independent workers and merged afterwards
+    """
+    grams = [
+        np.lib.stride_tricks.sliding_window_view(hash_tokens(pad_tokens(tokens, n)), n)
+        for tokens in token_docs
+        if tokens
+    ]
+    if not grams:
+        return np.empty((0, n), dtype=np.int64), np.empty(0, dtype=np.int64)
+    unique, counts = np.unique(np.concatenate(grams), axis=0, return_counts=True)
+    return unique, counts.astype(np.int64)
+
+
+def merge_hashed_counts(*tables: tuple[np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """merge (hashed n-grams, counts) tables into one table with unique rows"""
+    tables = [t for t in tables if len(t[0])]
+    if len(tables) == 1:
+        return tables[0]
+    if not tables:
+        return np.empty((0, 0), dtype=np.int64), np.empty(0, dtype=np.int64)
+    grams = np.concatenate([g for g, _ in tables])
+    counts = np.concatenate([c for _, c in tables])
+    unique, inverse = np.unique(grams, axis=0, return_inverse=True)
+    merged = np.bincount(inverse.ravel(), weights=counts, minlength=len(unique))
+    return unique, merged.astype(np.int64)
+
+
+class NgramCounter:
+    """
+    accumulates hashed n-gram count tables, merging them in memory and
+    spilling merged runs to `spill_dir` once more than `max_rows` rows are held
+    """
+
+    def __init__(self, n: int, max_rows: int = 20_000_000, spill_dir: str | os.PathLike | None = None):
+        self.n = n
+        self.max_rows = max_rows
+        self.spill_dir = pathlib.Path(spill_dir) if spill_dir is not None else None
+        self.tables: list[tuple[np.ndarray, np.ndarray]] = []
+        self.rows = 0
+        self.runs: list[pathlib.Path] = []
+
+    def add(self, grams: np.ndarray, counts: np.ndarray):
+        self.tables.append((grams, counts))
+        self.rows += len(grams)
+        if self.rows > self.max_rows:
+            self.tables = [merge_hashed_counts(*self.tables)]
+            self.rows = len(self.tables[0][0])
+            # merging alone did not free enough memory: move the run to disk
+            if self.rows > self.max_rows // 2 and self.spill_dir is not None:
+                self._spill()
+
+    def _spill(self):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / f"run_{len(self.runs):05d}.npz"
+        grams, counts = self.tables[0]
+        np.savez(path, grams=grams, counts=counts)
+        self.runs.append(path)
+        self.tables, self.rows = [], 0
+
+    def merged(self) -> tuple[np.ndarray, np.ndarray]:
+        """merge every in-memory table and spilled run into one table"""
+        grams, counts = merge_hashed_counts(*self.tables)
+        for path in self.runs:
+            with np.load(path) as run:
+                grams, counts = merge_hashed_counts((grams, counts), (run["grams"], run["counts"]))
+            os.remove(path)
+        self.tables, self.rows, self.runs = [], 0, []
+        return grams.reshape(-1, self.n), counts
+
+
+def _find(keys: np.ndarray, queries: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """positions of queries in sorted keys, and whether they were found"""
+    if len(keys) == 0:
+        return np.zeros(len(queries), dtype=np.int64), np.zeros(len(queries), dtype=bool)
+    idx = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return idx, keys[idx] == queries
+
+
+def _sorted(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(keys, kind="stable")
+    return keys[order], values[order]
+
+
+def _group(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """unique sorted keys, sum of values per key and number of rows per key"""
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    return keys[starts], np.add.reduceat(values, starts).astype(np.int64), sizes.astype(np.int64)
+
+
+class CompactKneserNey:
+    """interpolated Kneser-Ney model over packed, sorted n-gram arrays
+
+    For the highest order raw counts are used, lower orders use continuation
+    counts (number of distinct left extensions), and the recursion bottoms out
+    in a uniform distribution over the vocabulary plus the unknown token.
+    """
+
+    def __init__(self, n: int, discount: float, arrays: dict[str, np.ndarray], meta: dict | None = None):
+        self.n = n
+        self.discount = discount
+        self.bits = id_bits(n)
+        self.arrays = arrays
+        self.vocab = arrays["vocab"]
+        self.unk_id = len(self.vocab)
+        if meta is None:
+            meta = {
+                "unigram_total": int(arrays["counts_1"].sum()),
+                "unigram_types": int(len(arrays["keys_1"])),
+            }
+        self.unigram_total = meta["unigram_total"]
+        self.unigram_types = meta["unigram_types"]
+
+    @property
+    def vocab_size(self) -> int:
+        """number of known tokens (without the unknown token)"""
+        return len(self.vocab)
+
+    @classmethod
+    def from_counts(
+        cls, vocab: np.ndarray, keys: np.ndarray, counts: np.ndarray, n: int, discount: float = 0.1
+    ) -> CompactKneserNey:
+        """
+        build the model from the sorted vocabulary hashes and the sorted,
+        unique highest-order keys with their counts
+        """
+        if len(keys) == 0:
+            raise ValueError("cannot build an n-gram model from an empty corpus")
+        bits = id_bits(n)
+        if len(vocab) >= 1 << bits:
+            raise ValueError(f"vocabulary of {len(vocab)} tokens does not fit in {bits} bits per id")
+        arrays = {"vocab": np.asarray(vocab, dtype=np.int64)}
+        arrays[f"keys_{n}"] = np.asarray(keys, dtype=np.int64)
+        arrays[f"counts_{n}"] = np.asarray(counts, dtype=np.int64)
+        for k in range(n, 1, -1):
+            order_keys = arrays[f"keys_{k}"]
+            # keys are sorted, so their prefixes (the contexts) are sorted as well
+            ctx_keys, ctx_totals, ctx_types = _group(order_keys >> bits, arrays[f"counts_{k}"])
+            arrays[f"ctx_keys_{k}"] = ctx_keys
+            arrays[f"ctx_totals_{k}"] = ctx_totals
+            arrays[f"ctx_types_{k}"] = ctx_types
+            # continuation counts of the lower order: distinct left extensions
+            suffixes = order_keys & ((1 << (bits * (k - 1))) - 1)
+            lower_keys, lower_counts = np.unique(suffixes, return_counts=True)
+            arrays[f"keys_{k - 1}"] = lower_keys
+            arrays[f"counts_{k - 1}"] = lower_counts.astype(np.int64)
+        return cls(n, discount, arrays)
+
+    @classmethod
+    def fit(cls, tokenized_texts: Iterable[Sequence[str]], n: int, discount: float = 0.1) -> CompactKneserNey:
+        """train the model on in-memory token lists"""
+        docs = [pad_tokens(tokens, n) for tokens in tokenized_texts if tokens]
+        vocab = np.unique(hash_tokens(list({token for doc in docs for token in doc})))
+        keys, counts = count_ngrams((encode_tokens(vocab, doc) for doc in docs), n)
+        return cls.from_counts(vocab, keys, counts, n, discount)
+
+    @classmethod
+    def from_hashed_counts(
+        cls,
+        grams: np.ndarray,
+        counts: np.ndarray,
+        n: int,
+        discount: float = 0.1,
+        max_vocab_size: int | None = None,
+    ) -> CompactKneserNey:
+        """
+        build the model from merged hashed n-gram counts, keeping at most
+        `max_vocab_size` of the most frequent tokens (the rest become unknown)
+        """
+        if len(grams) == 0:
+            raise ValueError("cannot build an n-gram model from an empty corpus")
+        limit = (1 << id_bits(n)) - 1
+        max_vocab_size = limit if max_vocab_size is None else min(max_vocab_size, limit)
+        # every token occurrence is the last element of exactly one padded n-gram
+        words, freqs, _ = _group(*_sorted(grams[:, -1], counts))
+        vocab = np.unique(grams)
+        if len(vocab) > max_vocab_size:
+            freq = np.zeros(len(vocab), dtype=np.int64)
+            freq[np.searchsorted(vocab, words)] = freqs
+            freq[np.searchsorted(vocab, hash_tokens([BOS, EOS]))] = np.iinfo(np.int64).max
+            vocab = np.sort(vocab[np.argsort(-freq, kind="stable")[:max_vocab_size]])
+        idx, found = _find(vocab, grams.ravel())
+        ids = np.where(found, idx, len(vocab)).reshape(grams.shape)
+        keys, counts = merge_counts((pack_columns(ids, id_bits(n)), counts))
+        return cls.from_counts(vocab, keys, counts, n, discount)
+
+    def save(self, path: str | os.PathLike):
+        """write the model as a directory of .npy files"""
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(path / f"{name}.npy", np.ascontiguousarray(array))
+        meta = {
+            "n": self.n,
+            "discount": self.discount,
+            "unigram_total": self.unigram_total,
+            "unigram_types": self.unigram_types,
+            "arrays": sorted(self.arrays),
+        }
+        with open(path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, mmap: bool = True) -> CompactKneserNey:
+        """open a saved model, memory-mapping the arrays by default"""
+        path = pathlib.Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mode) for name in meta["arrays"]}
+        return cls(meta["n"], meta["discount"], arrays, meta)
+
+    def encode(self, tokens: Sequence[str]) -> np.ndarray:
+        """map tokens to ids, unknown tokens map to `unk_id`"""
+        return encode_tokens(self.vocab, tokens)
+
+    def ngram_probs(self, grams: np.ndarray) -> np.ndarray:
+        """
+        probabilities of the last id of each row of an (m, n) id matrix given
+        the first n-1 ids as context
+        """
+        d = self.discount
+        words = grams[:, -1]
+        # uniform base distribution interpolated with continuation unigrams
+        p = np.full(len(grams), 1.0 / (self.vocab_size + 1))
+        idx, found = _find(self.arrays["keys_1"], words)
+        c = np.where(found, self.arrays["counts_1"][idx], 0)
+        p = (np.maximum(c - d, 0) + d * self.unigram_types * p) / self.unigram_total
+        for k in range(2, self.n + 1):
+            ctx = pack_columns(grams[:, self.n - k : self.n - 1], self.bits)
+            idx, found = _find(self.arrays[f"keys_{k}"], (ctx << self.bits) | words)
+            c = np.where(found, self.arrays[f"counts_{k}"][idx], 0)
+            idx, seen = _find(self.arrays[f"ctx_keys_{k}"], ctx)
+            total = np.where(seen, self.arrays[f"ctx_totals_{k}"][idx], 1)
+            types = np.where(seen, self.arrays[f"ctx_types_{k}"][idx], 0)
+            # unseen contexts back off to the lower order unchanged
+            p = np.where(seen, (np.maximum(c - d, 0) + d * types * p) / total, p)
+        return p
+
+    def score(self, word: str, context: Sequence[str] | None = None) -> float:
+        """P(word | context), same call signature as nltk.lm models"""
+        context = list(context or ())
+        context = context[max(len(context) - (self.n - 1), 0) :]
+        context = [BOS] * (self.n - 1 - len(context)) + context
+        grams = self.encode(context + [word])[None, :]
+        return float(self.ngram_probs(grams)[0])
+
+    def doc_grams(self, token_docs: Sequence[Sequence[str]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (m, n) id matrix of every n-gram of every padded document, and the
+        number of n-grams per document
+        """
+        docs = [pad_tokens(tokens, self.n) for tokens in token_docs]
+        lengths = np.array([len(doc) for doc in docs], dtype=np.int64)
+        ids = self.encode([token for doc in docs for token in doc])
+        # windows over the concatenation, minus the ones crossing a document boundary
+        windows = np.lib.stride_tricks.sliding_window_view(ids, self.n)
+        num_grams = lengths - self.n + 1
+        doc_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+        gram_starts = np.r_[0, np.cumsum(num_grams)[:-1]]
+        starts = np.arange(num_grams.sum()) + np.repeat(doc_starts - gram_starts, num_grams)
+        return windows[starts], num_grams
+
+    def log_probs(self, token_docs: Sequence[Sequence[str]], epsilon: float = 1e-12) -> tuple[np.ndarray, np.ndarray]:
+        """natural-log probabilities of every padded token of every document, and tokens per document"""
+        grams, num_grams = self.doc_grams(token_docs)
+        return np.log(np.maximum(self.ngram_probs(grams), epsilon)), num_grams
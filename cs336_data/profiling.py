@@ -0,0 +1,125 @@
+"""
+Per-stage instrumentation for the filtering and deduplication pipelines.
+
+Each stage records wall time, documents in and out, and bytes processed.
+`PipelineStats` logs a progress line every `log_interval` seconds and can
+dump a machine-readable JSON summary. `profile` wraps a block in cProfile
+(`generate_data.py --profile`); the stage timers, not the profile, are what
+attribute time to stage names.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import json
+import logging
+import os
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats:
+    name: str
+    wall_time: float = 0.0
+    docs_in: int = 0
+    docs_out: int = 0
+    bytes_in: int = 0
+
+    def summary(self) -> dict:
+        result = asdict(self)
+        result["docs_per_sec"] = self.docs_in / self.wall_time if self.wall_time else 0.0
+        result["mb_per_sec"] = self.bytes_in / 1e6 / self.wall_time if self.wall_time else 0.0
+        result["pass_rate"] = self.docs_out / self.docs_in if self.docs_in else 0.0
+        return result
+
+
+class StageOutcome:
+    """set `passed = False` inside a stage block when the document is dropped"""
+
+    def __init__(self):
+        self.passed = True
+
+
+class PipelineStats:
+    def __init__(self, log_interval: float | None = 30.0):
+        self.stages: dict[str, StageStats] = {}
+        self.log_interval = log_interval
+        self.started = time.perf_counter()
+        self._last_log = self.started
+
+    def _stage(self, name: str) -> StageStats:
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def record(self, name: str, wall_time: float, docs_in: int = 1, docs_out: int = 1, nbytes: int = 0):
+        stage = self._stage(name)
+        stage.wall_time += wall_time
+        stage.docs_in += docs_in
+        stage.docs_out += docs_out
+        stage.bytes_in += nbytes
+        if self.log_interval is not None and time.perf_counter() - self._last_log >= self.log_interval:
+            self.log()
+
+    @contextmanager
+    def stage(self, name: str, nbytes: int = 0) -> Iterator[StageOutcome]:
+        """time one document going through a stage"""
+        outcome = StageOutcome()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.record(name, time.perf_counter() - start, 1, int(outcome.passed), nbytes)
+
+    def iterate(self, name: str, items: Iterable, nbytes: Callable[[object], int] | None = None) -> Iterator:
+        """time the production of every item of an iterator (e.g. extraction)"""
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(name, time.perf_counter() - start, 0, 0)
+                return
+            self.record(name, time.perf_counter() - start, 1, 1, nbytes(item) if nbytes else 0)
+            yield item
+
+    def log(self):
+        self._last_log = time.perf_counter()
+        elapsed = self._last_log - self.started
+        parts = [
+            f"{s.name}: {s.docs_in}->{s.docs_out} docs {s.wall_time:.1f}s {s.bytes_in / 1e6:.1f}MB"
+            for s in self.stages.values()
+        ]
+        logger.info(f"[{elapsed:.0f}s] " + " | ".join(parts))
+
+    def summary(self) -> dict:
+        return {
+            "elapsed": time.perf_counter() - self.started,
+            "stages": {name: stage.summary() for name, stage in self.stages.items()},
+        }
+
+    def write_json(self, path: str | os.PathLike):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+@contextmanager
+def profile(output_path: str | os.PathLike | None):
+    """run the block under cProfile and dump the stats to output_path (no-op for None)"""
+    if output_path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(output_path))
+        logger.info(f"cProfile stats written to {output_path}")
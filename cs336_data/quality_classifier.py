@@ -0,0 +1,235 @@
+"""
+fastText quality classifier: documents linked from Wikipedia (`WIKI_PATH`) are
+positives ("wiki"), Common Crawl documents are negatives ("cc").
+
+1. stream both sources, normalize and deduplicate them and write fastText
+   training/validation files
+2. train a supervised fastText model and fit Platt scaling on the
+   validation split so the returned probabilities are calibrated
+3. serve the model through the cached, batched inference path of `identifier`
+"""
+
+import functools
+import json
+import os
+import pathlib
+import random
+from collections.abc import Iterable, Iterator, Sequence
+
+import fasttext
+import mmh3
+import numpy as np
+
+from cs336_data import common, identifier
+from cs336_data.extractor import extract_texts_from_warc, extract_wet_texts_from_warc_file
+from cs336_data.features import DocumentFeatures
+
+POSITIVE_LABEL = "wiki"
+NEGATIVE_LABEL = "cc"
+
+
+def normalize_document(text: str | DocumentFeatures) -> str:
+    """collapse all whitespace so that a document fits on one fastText line"""
+    if isinstance(text, DocumentFeatures):
+        return text.collapsed
+    return " ".join(text.split())
+
+
+def iter_wiki_texts(wiki_dir: str | os.PathLike = common.WIKI_PATH) -> Iterator[str]:
+    """stream the .txt documents of the wiki directory"""
+    with os.scandir(wiki_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".txt") and entry.is_file():
+                with open(entry.path, encoding="utf-8", errors="replace") as f:
+                    yield f.read()
+
+
+def iter_cc_texts(cc_paths: Iterable[str | os.PathLike]) -> Iterator[str]:
+    """stream documents from Common Crawl WARC or WET files"""
+    for path in cc_paths:
+        if ".wet" in os.path.basename(path):
+            yield from extract_wet_texts_from_warc_file(path)
+        else:
+            yield from extract_texts_from_warc(path)
+
+
+def default_cc_paths(cc_dir: str | os.PathLike = common.CC_PATH) -> list[pathlib.Path]:
+    return sorted(pathlib.Path(cc_dir).glob("*.warc*"))
+
+
+def build_training_files(
+    train_path: str | os.PathLike,
+    valid_path: str | os.PathLike,
+    positives: Iterable[str] | None = None,
+    negatives: Iterable[str] | None = None,
+    valid_fraction: float = 0.1,
+    max_docs_per_label: int | None = None,
+    min_words: int = 5,
+    seed: int = 0,
+) -> dict[str, int]:
+    """
+    write fastText training and validation files from positive (wiki) and
+    negative (cc) documents, streaming both sources and dropping exact
+    duplicates of the normalized text; returns the number of documents per label
+    """
+    if positives is None:
+        positives = iter_wiki_texts()
+    if negatives is None:
+        negatives = iter_cc_texts(default_cc_paths())
+    # round-robin over the sources so that the training file is not sorted by label; a source is
+    # dropped as soon as its label is full, so that no further documents are read or extracted
+    sources = {POSITIVE_LABEL: iter(positives), NEGATIVE_LABEL: iter(negatives)}
+    rng = random.Random(seed)
+    seen = set()
+    counts = {POSITIVE_LABEL: 0, NEGATIVE_LABEL: 0}
+    with open(train_path, "w", encoding="utf-8") as train_f, open(valid_path, "w", encoding="utf-8") as valid_f:
+        while sources:
+            for label in list(sources):
+                if max_docs_per_label is not None and counts[label] >= max_docs_per_label:
+                    del sources[label]
+                    continue
+                text = next(sources[label], None)
+                if text is None:
+                    del sources[label]
+                    continue
+                text = normalize_document(text)
+                if len(text.split(" ")) < min_words:
+                    continue
+                digest = mmh3.hash64(text)[0]
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                counts[label] += 1
+                out = valid_f if rng.random() < valid_fraction else train_f
+                out.write(f"__label__{label} {text}\n")
+    return counts
+
+
+def read_labeled_file(path: str | os.PathLike) -> tuple[list[str], list[str]]:
+    """labels and texts of a fastText training file"""
+    labels, texts = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            label, _, text = line.rstrip("\n").partition(" ")
+            labels.append(label.removeprefix("__label__"))
+            texts.append(text)
+    return labels, texts
+
+
+def fit_platt_scaling(scores: np.ndarray, targets: np.ndarray, max_iters: int = 100) -> tuple[float, float]:
+    """
+    fit p = sigmoid(a * logit(score) + b) by Newton's method, with Platt's
+    smoothed targets so that separable data does not diverge
+    """
+    x = _logit(scores)
+    num_pos = targets.sum()
+    num_neg = len(targets) - num_pos
+    y = np.where(targets, (num_pos + 1) / (num_pos + 2), 1 / (num_neg + 2))
+    a, b = 1.0, 0.0
+    for _ in range(max_iters):
+        p = _sigmoid(a * x + b)
+        w = p * (1 - p) + 1e-12
+        grad = np.array([np.sum((p - y) * x), np.sum(p - y)])
+        hess = np.array([[np.sum(w * x * x), np.sum(w * x)], [np.sum(w * x), np.sum(w)]]) + 1e-9 * np.eye(2)
+        step = np.linalg.solve(hess, grad)
+        a, b = a - step[0], b - step[1]
+        if np.abs(step).max() < 1e-9:
+            break
+    return float(a), float(b)
+
+
+def _logit(p: np.ndarray) -> np.ndarray:
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    return np.log(p) - np.log1p(-p)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return np.exp(-np.logaddexp(0, -x))
+
+
+def calibration_path(model_path: str | os.PathLike) -> pathlib.Path:
+    return pathlib.Path(model_path).with_suffix(".calibration.json")
+
+
+@functools.cache
+def load_calibration(model_path: str) -> tuple[float, float]:
+    """Platt scaling parameters of a model, identity if it was never calibrated"""
+    path = calibration_path(model_path)
+    if not path.exists():
+        return 1.0, 0.0
+    with open(path) as f:
+        params = json.load(f)
+    return params["a"], params["b"]
+
+
+def _positive_probs(texts: Sequence[str | DocumentFeatures], model_path: str | os.PathLike) -> np.ndarray:
+    """uncalibrated fastText probability of the positive label"""
+    probs = identifier.predict_probs_batch([normalize_document(text) for text in texts], model_path)
+    return np.array([p.get(POSITIVE_LABEL, 0.0) for p in probs])
+
+
+def train_quality_classifier(
+    train_path: str | os.PathLike,
+    valid_path: str | os.PathLike,
+    model_path: str | os.PathLike = common.QUALITY_MODEL_PATH,
+    epoch: int = 5,
+    lr: float = 0.1,
+    word_ngrams: int = 2,
+    dim: int = 100,
+    min_count: int = 2,
+    threads: int | None = None,
+) -> dict[str, float]:
+    """train the classifier, calibrate it on the validation file and save both"""
+    model = fasttext.train_supervised(
+        input=str(train_path),
+        epoch=epoch,
+        lr=lr,
+        wordNgrams=word_ngrams,
+        dim=dim,
+        minCount=min_count,
+        thread=threads or os.cpu_count(),
+        verbose=0,
+    )
+    pathlib.Path(model_path).parent.mkdir(parents=True, exist_ok=True)
+    model.save_model(str(model_path))
+    identifier.load_model.cache_clear()
+    load_calibration.cache_clear()
+
+    labels, texts = read_labeled_file(valid_path)
+    targets = np.array([label == POSITIVE_LABEL for label in labels])
+    metrics = {"num_valid": len(texts)}
+    if len(texts) and 0 < targets.sum() < len(targets):
+        raw = _positive_probs(texts, model_path)
+        a, b = fit_platt_scaling(raw, targets)
+        with open(calibration_path(model_path), "w") as f:
+            json.dump({"a": a, "b": b}, f)
+        load_calibration.cache_clear()
+        p = np.clip(_sigmoid(a * _logit(raw) + b), 1e-12, 1 - 1e-12)
+        metrics["accuracy"] = float(np.mean((p >= 0.5) == targets))
+        metrics["log_loss"] = float(-np.mean(np.where(targets, np.log(p), np.log(1 - p))))
+    return metrics
+
+
+def quality_classification_batch(
+    texts: Sequence[str | DocumentFeatures], model_path: str | os.PathLike = common.QUALITY_MODEL_PATH
+) -> list[tuple[str, float]]:
+    """(label, calibrated probability of that label) for every text"""
+    if not texts:
+        return []
+    a, b = load_calibration(str(model_path))
+    p = _sigmoid(a * _logit(_positive_probs(texts, model_path)) + b)
+    return [(POSITIVE_LABEL, float(q)) if q >= 0.5 else (NEGATIVE_LABEL, float(1 - q)) for q in p]
+
+
+def quality_classification(
+    text: str | DocumentFeatures, model_path: str | os.PathLike = common.QUALITY_MODEL_PATH
+) -> tuple[str, float]:
+    return quality_classification_batch([text], model_path)[0]
+
+
+if __name__ == "__main__":
+    train_file = common.ASSETS_PATH / "quality.train"
+    valid_file = common.ASSETS_PATH / "quality.valid"
+    common.ASSETS_PATH.mkdir(parents=True, exist_ok=True)
+    print(build_training_files(train_file, valid_file))
+    print(train_quality_classifier(train_file, valid_file))
@@ -1,35 +1,31 @@
-import nltk
-try:
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    nltk.download('punkt_tab')
-from nltk.tokenize import word_tokenize
 from cs336_data.extractor import extract_texts_from_warc
-from cs336_data.train import perplexity_of_text, tokenize_english
-import pickle
+from cs336_data.features import DocumentFeatures, as_features
+from cs336_data.train import perplexity_of_text, sampled_perplexity_of_text, tokenize_english, load_ngram_model
+import math
 import os
 import cs336_data.common as common
+from cs336_data.quality_classifier import quality_classification
 from typing import Any
 
 
-def gopher_filter(text: str) -> bool:
+def gopher_filter(text: str | DocumentFeatures) -> bool:
     """判断是否通过gopher quality检测
         Contain less than 50 or more than 100,000 words.
         Have a mean word length outside the range of 3 to 10 characters.
         Have more than 30% of lines ending with an ellipsis (“...”).
         Contain less than 80% of words with at least one alphabetic character.
     """
-    tokens = word_tokenize(text)
+    doc = as_features(text)
+    tokens = doc.tokens
     length = len(tokens)
     if length < 50 or length > 100_000:
         return False
 
-    mean_word_length = sum(len(token) for token in tokens) / length
+    mean_word_length = doc.mean_word_length
     if mean_word_length < 3 or mean_word_length > 10:
         return False
 
-    lines = text.splitlines()
-    non_empty_lines = [line.strip() for line in lines if line.strip()]
+    non_empty_lines = doc.non_empty_lines
     num_ellipsisi_ended_lines = sum(1 for line in non_empty_lines if line.endswith("..."))
     percent_ellipsis_ended_lines = num_ellipsisi_ended_lines / len(non_empty_lines)
     if percent_ellipsis_ended_lines > 0.3:
@@ -45,22 +41,33 @@ def gopher_filter(text: str) -> bool:
     
     return True
 
-def classify_quality(text: str) -> tuple[Any, float]:
+def classify_quality(
+    text: str | DocumentFeatures, ppl_threshold: float = 500, sample: bool = False, seed: int = 0
+) -> tuple[Any, float]:
+    # fastText 分类器（quality_classifier.py 训练得到）优先：比 n-gram 困惑度便宜得多
+    if os.path.exists(common.QUALITY_MODEL_PATH):
+        return quality_classification(text)
     # load model
-    if os.path.exists(common.ASSETS_PATH / "model.pkl"):
-        with open(common.ASSETS_PATH / "model.pkl", "rb") as f:
-            model = pickle.load(f)
+    if os.path.exists(common.NGRAM_MODEL_PATH / "meta.json"):
+        model = load_ngram_model()
     else:
-        print("No model found. Please run perplexity_of_file.py first.")
+        print("No model found. Please run quality_classifier.py or train.py first.")
         exit()
     n = 3  # trigram 推荐起点
     tokenizer = tokenize_english
-    ppl = perplexity_of_text(model, tokenizer(text), n)
-    # TODO: provide real quality score instead of just using placeholder 0.9
-    if ppl < 500:
-        return "wiki", 0.9
+    doc = as_features(text)
+    if sample:
+        # 逐句抽样打分，结论确定后提前停止
+        ppl = sampled_perplexity_of_text(model, doc.text, tokenizer, ppl_threshold, seed=seed)["perplexity"]
     else:
-        return "cc", 0.9
+        # tokenize_english 就是 word_tokenize，直接复用 gopher_filter 已经算好的 tokens
+        ppl = perplexity_of_text(model, doc.tokens, n)
+    # confidence grows with the distance from the threshold in log space
+    confidence = 1 / (1 + math.exp(-abs(math.log(ppl) - math.log(ppl_threshold))))
+    if ppl < ppl_threshold:
+        return "wiki", confidence
+    else:
+        return "cc", confidence
     
     
 if __name__ == "__main__":
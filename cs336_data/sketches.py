@@ -0,0 +1,105 @@
+"""
+Compact MinHash sketches for deduplication.
+
+`deduplication.get_signature` computes num_hashes md5 digests per ngram and
+keeps 128-bit Python ints. The sketches here work on the 64-bit ngram hashes
+of `deduplication.hash_ngrams` instead:
+
+- one-permutation hashing (OPH): a single hash of every ngram picks one of
+  num_hashes bins and the bin keeps its minimum, so hashing costs one pass
+  over the ngrams instead of num_hashes. Empty bins (short documents) are
+  filled by optimal densification: bin i borrows the value of the first
+  non-empty bin of its own pseudo-random probe sequence.
+- b-bit storage: only the lowest b bits (8, 16 or 32) of every slot are kept.
+  Unrelated slots then agree with probability 2^-b, which `estimate_jaccard`
+  removes: J = (match - 2^-b) / (1 - 2^-b).
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+EMPTY = np.uint64(np.iinfo(np.uint64).max)
+BIT_DTYPES = {8: np.uint8, 16: np.uint16, 32: np.uint32, 64: np.uint64}
+_MASK64 = (1 << 64) - 1
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, a bijection on uint64 arrays"""
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def fold_signature(signature: list[int] | np.ndarray) -> np.ndarray:
+    """md5 minhashes (128-bit ints, inf for an empty ngram set) folded to uint64"""
+    if isinstance(signature, np.ndarray):
+        return signature
+    return np.array(
+        [(x ^ (x >> 64)) & _MASK64 if x != float("inf") else _MASK64 for x in signature], dtype=np.uint64
+    )
+
+
+def one_permutation_signature(hashes: np.ndarray, num_hashes: int, seed: int = 0) -> np.ndarray:
+    """densified one-permutation minhash of a set of uint64 ngram hashes"""
+    signature = np.full(num_hashes, EMPTY, dtype=np.uint64)
+    if len(hashes) == 0:
+        return signature
+    h = mix64(np.asarray(hashes, dtype=np.uint64) ^ np.uint64(seed))
+    np.minimum.at(signature, h % np.uint64(num_hashes), h)
+    filled = signature != EMPTY
+    empty = np.flatnonzero(~filled)
+    attempt = 0
+    while len(empty):
+        # probe sequence of bin i: mix64(seed, i, attempt) mod num_hashes, the same for every document
+        probe = mix64(np.uint64(seed) ^ (empty.astype(np.uint64) << np.uint64(32)) + np.uint64(attempt))
+        source = (probe % np.uint64(num_hashes)).astype(np.int64)
+        found = filled[source]
+        signature[empty[found]] = signature[source[found]]
+        empty = empty[~found]
+        attempt += 1
+    return signature
+
+
+def b_bit_signature(signature: list[int] | np.ndarray, bits: int) -> np.ndarray:
+    """keep the lowest `bits` bits of every slot (8, 16, 32 or 64)"""
+    if bits not in BIT_DTYPES:
+        raise ValueError(f"bits must be one of {list(BIT_DTYPES)}, got {bits}")
+    # mix first so that the low bits are uniform whatever produced the minhash
+    return mix64(fold_signature(signature)).astype(BIT_DTYPES[bits])
+
+
+def estimate_jaccard(sgn1, sgn2, bits: int | None = None) -> float:
+    """fraction of agreeing slots, corrected for accidental b-bit agreement"""
+    match = float(np.mean(np.asarray(sgn1) == np.asarray(sgn2)))
+    if bits is None or bits == 64:
+        return match
+    chance = 2.0 ** -bits
+    return min(1.0, max(0.0, (match - chance) / (1 - chance)))
+
+
+class SignatureMatrix:
+    """signatures of equal length stored row by row in one growing array"""
+
+    def __init__(self, num_hashes: int, dtype, capacity: int = 1024):
+        self._rows = np.empty((capacity, num_hashes), dtype=dtype)
+        self.num_rows = 0
+
+    def append(self, signature: np.ndarray) -> int:
+        if self.num_rows == len(self._rows):
+            self._rows = np.resize(self._rows, (2 * len(self._rows), self._rows.shape[1]))
+        self._rows[self.num_rows] = signature
+        self.num_rows += 1
+        return self.num_rows - 1
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self._rows[i]
+
+    @property
+    def nbytes(self) -> int:
+        return self._rows[: self.num_rows].nbytes
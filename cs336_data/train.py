@@ -5,20 +5,22 @@ to do qulification detection.
 """
 
 import os
+import functools
+import itertools
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import numpy as np
 import random
 import nltk
-import pickle
 try:
     nltk.data.find('tokenizers/punkt_tab')
 except LookupError:
     nltk.download('punkt_tab')
 from nltk.tokenize import word_tokenize
-from nltk.lm import KneserNeyInterpolated  # 平滑良好
-from nltk.lm.preprocessing import padded_everygram_pipeline, pad_both_ends
-from nltk.util import ngrams
+from nltk.lm.preprocessing import pad_both_ends
 import math
 from cs336_data import common
+from cs336_data.ngram import CompactKneserNey, NgramCounter, count_hashed_ngrams
 
 
 # 英文简单分词（或者用 nltk.word_tokenize）
@@ -41,14 +43,86 @@ def load_corpus_from_dir(dir_path, tokenizer):
 
 # 训练 n-gram 模型 (Kneser-Ney)
 def train_ngram_model(tokenized_texts, n):
-    train_data, vocab = padded_everygram_pipeline(n, tokenized_texts)
-    model = KneserNeyInterpolated(n)   # 推荐：Kneser-Ney
-    model.fit(train_data, vocab)
-    return model
+    # array-backed Kneser-Ney instead of nltk's KneserNeyInterpolated:
+    # same padding and score(word, context) API, but compact and memory-mappable
+    return CompactKneserNey.fit(tokenized_texts, n)
+
+# 逐个文件流式读取，避免一次性把整个语料读进内存
+def iter_corpus_files(dir_path):
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name.endswith(".txt") and entry.is_file():
+                yield entry.path
+
+def _count_files(paths, tokenizer, n):
+    """worker: tokenize a chunk of files and count their hashed n-grams"""
+    def docs():
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                yield tokenizer(f.read())
+    return count_hashed_ngrams(docs(), n)
+
+def train_ngram_model_streaming(
+    dir_path,
+    n,
+    tokenizer=tokenize_english,
+    num_workers=None,
+    files_per_task=256,
+    max_rows_in_memory=20_000_000,
+    spill_dir=None,
+    max_vocab_size=None,
+):
+    """
+    train the n-gram model on every .txt file under dir_path without holding
+    the corpus in memory: workers count n-grams of file chunks into mergeable
+    count tables, the parent merges them (spilling merged runs to disk when they
+    grow past max_rows_in_memory) and builds the model from the merged counts
+    """
+    num_workers = num_workers or os.cpu_count()
+    files = iter_corpus_files(dir_path)
+    chunks = iter(lambda: list(itertools.islice(files, files_per_task)), [])
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        counter = NgramCounter(n, max_rows=max_rows_in_memory, spill_dir=tmp_dir)
+        with ProcessPoolExecutor(num_workers) as executor:
+            # keep a bounded number of chunks in flight
+            pending = set()
+            for chunk in chunks:
+                pending.add(executor.submit(_count_files, chunk, tokenizer, n))
+                if len(pending) >= 2 * num_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        counter.add(*future.result())
+            for future in wait(pending).done:
+                counter.add(*future.result())
+        grams, counts = counter.merged()
+    return CompactKneserNey.from_hashed_counts(grams, counts, n, max_vocab_size=max_vocab_size)
+
+@functools.cache
+def load_ngram_model(path=common.NGRAM_MODEL_PATH):
+    """load a saved model once per process; the arrays are memory-mapped"""
+    return CompactKneserNey.load(path)
+
+# 批量计算多篇文本的对数困惑度：一次性查表，不逐个 n-gram 调用 model.score
+def batch_log_perplexity(model, token_docs, epsilon=1e-12, return_token_logprobs=False):
+    """
+    log-perplexity of each token list in token_docs under a CompactKneserNey model,
+    optionally together with the per-token log-probs of each document
+    """
+    if not token_docs:
+        log_ppl = np.empty(0)
+        return (log_ppl, []) if return_token_logprobs else log_ppl
+    logprobs, num_grams = model.log_probs(token_docs, epsilon)
+    doc_starts = np.r_[0, np.cumsum(num_grams)[:-1]]
+    log_ppl = -np.add.reduceat(logprobs, doc_starts) / num_grams
+    if return_token_logprobs:
+        return log_ppl, np.split(logprobs, doc_starts[1:])
+    return log_ppl
 
 # 用模型计算单篇文本的困惑度（手工计算以避免 API 细节差异）
 def perplexity_of_text(model, tokens, n, epsilon=1e-12):
     # tokens: list of tokens (未加 pad)
+    if isinstance(model, CompactKneserNey):
+        return math.exp(batch_log_perplexity(model, [tokens], epsilon)[0])
     padded = list(pad_both_ends(tokens, n))
     N = 0
     log_prob_sum = 0.0
@@ -67,16 +141,75 @@ def perplexity_of_text(model, tokens, n, epsilon=1e-12):
     ppl = math.exp(-log_prob_sum / N)
     return ppl
 
-def sample_sentences_from_file(filepath, sample_size=10):
+def sample_sentences_from_file(filepath, sample_size=10, seed=None):
     with open(filepath, encoding='utf-8') as f:
         text = f.read()
     sentences = nltk.sent_tokenize(text)  # 拆句子
     if len(sentences) <= sample_size:
         return sentences  # 文本太短就返回全部
-    return random.sample(sentences, sample_size)  # 随机抽样
+    return random.Random(seed).sample(sentences, sample_size)  # 随机抽样（可复现）
 
-def perplexity_of_file(model, filepath, tokenizer, n):
-    samples = sample_sentences_from_file(filepath, sample_size=10)
+# 按随机顺序逐句打分，一旦困惑度估计的置信区间完全落在阈值一侧就提前停止
+def sampled_perplexity_of_text(
+    model, text, tokenizer, threshold, seed=0, min_sentences=3, max_sentences=None, batch_size=4, z=1.96
+):
+    """
+    estimate the perplexity of a document from randomly ordered sentences,
+    stopping once the z-sigma confidence interval of the (token-weighted) log
+    perplexity is entirely above or below log(threshold)
+
+    returns {"perplexity", "num_sentences", "total_sentences", "decided"}; total_sentences
+    counts the whole document, also when max_sentences caps the sample. decided is False
+    when the sentences (or max_sentences) ran out before the interval cleared the threshold,
+    so a forced decision can be told apart from a confident one
+    """
+    sentences = nltk.sent_tokenize(text)
+    random.Random(seed).shuffle(sentences)
+    # the population is the whole document, also when max_sentences truncates the sample
+    population = len(sentences)
+    if max_sentences is not None:
+        sentences = sentences[:max_sentences]
+    log_threshold = math.log(threshold)
+    nll_sums, token_counts = [], []
+    num_scored, decided = 0, False
+    for start in range(0, len(sentences), batch_size):
+        batch = sentences[start : start + batch_size]
+        num_scored += len(batch)
+        token_docs = [tokens for tokens in map(tokenizer, batch) if tokens]
+        if token_docs:
+            log_ppl = batch_log_perplexity(model, token_docs)
+            num_grams = np.array([len(tokens) + model.n - 1 for tokens in token_docs])
+            nll_sums.extend(log_ppl * num_grams)
+            token_counts.extend(num_grams)
+        fpc = max(1 - num_scored / population, 0.0)
+        # with every sentence scored the estimate is exact, otherwise wait for min_sentences
+        if not nll_sums or (fpc > 0 and len(nll_sums) < max(min_sentences, 2)):
+            continue
+        # ratio estimator and its standard error, with finite population correction
+        x, y = np.array(nll_sums), np.array(token_counts)
+        estimate = x.sum() / y.sum()
+        m = len(x)
+        stderr = 0.0
+        if fpc > 0:
+            residual_var = np.sum((x - estimate * y) ** 2) / (m - 1)
+            stderr = math.sqrt(fpc * residual_var / m) / y.mean()
+        if abs(estimate - log_threshold) > z * stderr:
+            decided = True
+            break
+    perplexity = math.exp(sum(nll_sums) / sum(token_counts)) if nll_sums else float("inf")
+    return {
+        "perplexity": perplexity,
+        "num_sentences": num_scored,
+        "total_sentences": population,
+        "decided": decided,
+    }
+
+def perplexity_of_file(model, filepath, tokenizer, n, threshold=None, seed=None):
+    if threshold is not None:
+        with open(filepath, encoding='utf-8') as f:
+            text = f.read()
+        return sampled_perplexity_of_text(model, text, tokenizer, threshold, seed=seed or 0)["perplexity"]
+    samples = sample_sentences_from_file(filepath, sample_size=10, seed=seed)
     perplexitiys = []
     for sample in samples:
         tokens = tokenizer(sample)
@@ -92,23 +225,20 @@ if __name__ == "__main__":
     test_dir = common.TEST_PATH   # 可选：用于验证/设阈值的非-Wiki 文档
     tokenizer = tokenize_english
 
-    if os.path.exists(common.ASSETS_PATH / "model.pkl"):
+    if os.path.exists(common.NGRAM_MODEL_PATH / "meta.json"):
         print("Loading model...")
-        with open(common.ASSETS_PATH / "model.pkl", "rb") as f:
-            model = pickle.load(f)
+        model = load_ngram_model()
     else:
         # 参数
         
-        # 载入语料（以列表形式：每个元素为一个 token 列表）
-        wiki_texts = load_corpus_from_dir(wiki_dir, tokenizer)
-        if not wiki_texts:
+        # 流式、多进程统计 n-gram 并训练模型
+        try:
+            model = train_ngram_model_streaming(wiki_dir, n, tokenizer)
+        except ValueError:
             print("No training texts found.")
             exit()
-        # 训练模型
-        model = train_ngram_model(wiki_texts, n)
         # Save the model
-        with open(common.ASSETS_PATH / "model.pkl", "wb") as f:
-            pickle.dump(model, f)
+        model.save(common.NGRAM_MODEL_PATH)
 
     
     for fn in os.listdir(test_dir):
@@ -0,0 +1,236 @@
+"""
+Background output writer shared by the pipeline stages.
+
+Stages hand finished outputs to an `AsyncWriter`, which compresses and writes
+them on a background thread while the caller keeps filtering/deduplicating.
+The queue between them is bounded, so a slow filesystem applies backpressure
+instead of buffering the whole corpus in memory. Files are not fsynced one by
+one: with `fsync_every` set, written files are kept open and synced in
+batches (and at close).
+
+    with AsyncWriter(compression="gzip") as writer:
+        for i, doc in enumerate(docs):
+            writer.write_file(out_dir / f"doc_{i}.txt", doc)   # -> doc_{i}.txt.gz
+"""
+
+from __future__ import annotations
+
+import errno
+import gzip
+import io
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import IO
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for compression="zstd"
+    zstandard = None
+
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+_CLOSE = object()
+
+
+def output_path(path: str | os.PathLike, compression: str | None) -> str:
+    """path with the suffix of the compression format appended"""
+    if compression not in SUFFIXES:
+        raise ValueError(f"unknown compression {compression!r}, expected one of {list(SUFFIXES)}")
+    path = os.fspath(path)
+    suffix = SUFFIXES[compression]
+    return path if path.endswith(suffix) else path + suffix
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError(
+            "compression='zstd' (.zst output) requires the zstandard package: pip install 'cs336-data[zstd]'"
+        )
+
+
+def _open(path: str, mode: str, compression: str | None, level: int | None) -> IO[bytes]:
+    if compression is None:
+        return open(path, mode)
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6 if level is None else level)
+    _require_zstandard()
+    return zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(
+        open(path, mode), closefd=True
+    )
+
+
+class AsyncWriter:
+    def __init__(
+        self,
+        compression: str | None = None,
+        level: int | None = None,
+        max_pending: int = 256,
+        fsync_every: int = 0,
+        flush_interval: float | None = 5.0,
+        encoding: str = "utf-8",
+    ):
+        """
+        compression: None, "gzip" or "zstd"; the matching suffix is appended to every path
+        max_pending: number of queued writes before write_file/append block
+        fsync_every: fsync after this many written files (0: never, rely on the OS)
+        flush_interval: seconds between flushes of the append streams
+        """
+        output_path("", compression)
+        if compression == "zstd":
+            _require_zstandard()
+        self.compression = compression
+        self.level = level
+        self.fsync_every = fsync_every
+        self.flush_interval = flush_interval
+        self.encoding = encoding
+        self.num_files = 0
+        self.num_bytes = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._streams: dict[str, IO[bytes]] = {}
+        self._unsynced: list[IO[bytes]] = []
+        self._error: BaseException | None = None
+        self._closed = False
+        self._last_flush = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="AsyncWriter", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> AsyncWriter:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _encode(self, data: str | bytes) -> bytes:
+        return data.encode(self.encoding) if isinstance(data, str) else data
+
+    def _put(self, item):
+        if self._closed:
+            raise ValueError("write to a closed AsyncWriter")
+        if self._error is not None:
+            raise self._error
+        self._queue.put(item)
+
+    def write_file(self, path: str | os.PathLike, data: str | bytes) -> str:
+        """write data as the whole content of path; returns the path actually written"""
+        path = output_path(path, self.compression)
+        self._put(("file", path, self._encode(data)))
+        return path
+
+    def append(self, path: str | os.PathLike, data: str | bytes) -> str:
+        """append data to a stream kept open until close (e.g. a JSONL shard)"""
+        path = output_path(path, self.compression)
+        self._put(("append", path, self._encode(data)))
+        return path
+
+    def close(self):
+        """wait until everything is written, synced and closed; re-raises a write error"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    # background thread
+
+    def _run(self):
+        while True:
+            timeout = self.flush_interval if self._streams and self.flush_interval else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if item is not None and self._error is None:
+                try:
+                    self._write(*item)
+                except BaseException as e:
+                    # surfaced to the producer on its next call
+                    self._error = e
+            if self.flush_interval and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_streams()
+        try:
+            self._finish()
+        except BaseException as e:
+            self._error = self._error or e
+
+    def _write(self, kind: str, path: str, data: bytes):
+        if kind == "append":
+            if path not in self._streams:
+                self._streams[path] = _open(path, "ab", self.compression, self.level)
+            self._streams[path].write(data)
+        else:
+            f = _open(path, "wb", self.compression, self.level)
+            f.write(data)
+            self.num_files += 1
+            if self.fsync_every:
+                self._unsynced.append(f)
+                if len(self._unsynced) >= self.fsync_every:
+                    self._sync()
+            else:
+                f.close()
+        self.num_bytes += len(data)
+
+    def _flush_streams(self):
+        for f in self._streams.values():
+            f.flush()
+        self._last_flush = time.monotonic()
+
+    def _sync(self):
+        for f in self._unsynced:
+            f.flush()
+            # compressed writers wrap the real file; close() finishes the
+            # compressed stream, which has to happen before the fsync
+            fileno = _fileno(f)
+            f.close()
+            if fileno is not None:
+                os.fsync(fileno)
+                os.close(fileno)
+        self._unsynced.clear()
+
+    def _finish(self):
+        for f in self._streams.values():
+            if self.fsync_every:
+                self._unsynced.append(f)
+            else:
+                f.close()
+        self._streams.clear()
+        self._sync()
+
+
+def copy_file(src: str | os.PathLike, dst: str | os.PathLike) -> int:
+    """
+    copy src to dst without pulling the bytes through Python: copy_file_range
+    (in-kernel, reflinks on filesystems that support them), else shutil's
+    sendfile/fcopyfile fast path; returns the number of bytes copied
+    """
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range is not None:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            size = os.fstat(fin.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = copy_range(fin.fileno(), fout.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                return copied
+            except OSError as e:
+                # e.g. EXDEV on old kernels or filesystems without support: fall through
+                if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                    raise
+    shutil.copyfile(src, dst)
+    return os.path.getsize(dst)
+
+
+def _fileno(f: IO[bytes]) -> int | None:
+    """a duplicate of the descriptor underneath f, which stays valid after f is closed"""
+    try:
+        return os.dup(f.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
@@ -23,6 +23,11 @@ def run_mask_phone_numbers(text: str) -> tuple[str, int]:
 def run_mask_ips(text: str) -> tuple[str, int]:
     return masker.mask_ips(text)
 
+def run_mask_pii_batch(
+    texts: list[str], num_workers: int | None = None, return_spans: bool = False
+) -> list[dict[str, Any]]:
+    return masker.mask_batch(texts, num_workers=num_workers, return_spans=return_spans)
+
 def run_classify_nsfw(text: str) -> tuple[Any, float]:
     return identifier.nsfw_detection(text)
 
@@ -0,0 +1,27 @@
+import copy
+
+from cs336_data.benchmark import Corpus, CorpusConfig, compare, run_benchmarks
+from cs336_data.extractor import extract_texts_from_warc
+
+
+def test_synthetic_corpus_is_deterministic(tmp_path):
+    config = CorpusConfig(num_docs=20, words_per_doc=50, vocab_size=200)
+    corpus = Corpus(config, tmp_path / "a")
+    assert corpus.docs == Corpus(config, tmp_path / "b").docs
+    assert len(corpus.text_files) == 20
+    assert len(list(extract_texts_from_warc(corpus.warc_path))) == 20
+
+
+def test_run_and_compare(tmp_path):
+    config = CorpusConfig(num_docs=20, words_per_doc=50, vocab_size=200)
+    report = run_benchmarks(["mask_all", "exact_line_deduplication"], config, repeat=1, isolate=False)
+    assert report["meta"]["corpus"]["num_docs"] == 20
+    for result in report["results"].values():
+        assert result["docs"] == 20
+        assert result["docs_per_sec"] > 0
+
+    slower = copy.deepcopy(report)
+    slower["results"]["mask_all"]["docs_per_sec"] /= 2
+    rows = {row["name"]: row for row in compare(report, slower)}
+    assert rows["mask_all"]["regressed"]
+    assert not rows["exact_line_deduplication"]["regressed"]
@@ -1,7 +1,16 @@
+import gzip
+import json
 import logging
+from collections import defaultdict
 
+import numpy as np
+import pytest
 from xopen import xopen
 
+from cs336_data import deduplication
+from cs336_data.lsh_planner import plan_lsh
+from cs336_data.writer import AsyncWriter
+
 from .adapters import run_exact_line_deduplication, run_minhash_deduplication
 from .common import FIXTURES_PATH
 
@@ -130,3 +139,176 @@ def test_minhash_deduplication_fuzzy_duplicates(tmp_path):
     assert len(deduplicated_documents) == 0
     # One of the kept deduplicated documents should be kept, and the other should be removed.
     assert len(kept_duplicated_documents) == 1
+
+
+@pytest.mark.parametrize("output_mode", ["copy", "write", "hardlink", "symlink"])
+def test_minhash_deduplication_output_modes(tmp_path, output_mode):
+    # inputs spread over two directories: each survivor is read from its own source path
+    sources = sorted((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))
+    input_dir = tmp_path / "inputs"
+    input_files = []
+    for i, path in enumerate(sources):
+        subdir = input_dir / str(i % 2)
+        subdir.mkdir(parents=True, exist_ok=True)
+        input_files.append(subdir / path.name)
+        input_files[-1].write_bytes(path.read_bytes())
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    survivors = deduplication.minhash_deduplication(input_files, 100, 10, 5, 0.8, out_dir, output_mode=output_mode)
+    assert len(survivors) == 4
+    for source in survivors:
+        assert (out_dir / source.name).read_bytes() == source.read_bytes()
+        if output_mode == "symlink":
+            assert (out_dir / source.name).is_symlink()
+        if output_mode == "hardlink":
+            assert (out_dir / source.name).stat().st_ino == source.stat().st_ino
+
+    manifest_dir = tmp_path / "manifest"
+    manifest_dir.mkdir()
+    deduplication.minhash_deduplication(input_files, 100, 10, 5, 0.8, manifest_dir, output_mode="manifest")
+    assert (manifest_dir / "survivors.txt").read_text().split() == [str(p.absolute()) for p in survivors]
+
+
+def test_minhash_deduplicate_records_from_jsonl(tmp_path):
+    texts = [path.read_text() for path in sorted((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))]
+    # the same document under two ids in two shards, plus a record without an id
+    shards = [tmp_path / "a.jsonl", tmp_path / "b.jsonl.gz"]
+    rows = [{"id": f"doc{i}", "text": text} for i, text in enumerate(texts)]
+    rows.append({"id": "copy", "text": texts[0]})
+    rows.append({"text": texts[1]})
+    with xopen(shards[0], "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows[:3])
+    with xopen(shards[1], "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows[3:])
+
+    result = deduplication.minhash_deduplicate_records(
+        deduplication.iter_jsonl_records(shards), num_hashes=100, num_bands=10, ngrams=5, jaccard_threshold=0.8
+    )
+    assert len(result.ids) == len(rows)
+    assert result.ids[-1] == (str(shards[1]), len(rows) - 4)
+    table = dict(result.cluster_table())
+    assert table["copy"] == "doc0"
+    assert table[result.ids[-1]] == table["doc1"]
+    assert result.keep.sum() == len(set(table.values()))
+
+
+def test_minhash_deduplication_with_planned_bands(tmp_path):
+    input_files = list((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    survivors = deduplication.minhash_deduplication(input_files, 100, None, 5, 0.8, tmp_path)
+    assert len(survivors) == len(input_files) - 1
+
+
+def test_exact_verification_with_hashed_ngram_sets():
+    texts = [path.read_text() for path in sorted((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))]
+    sets = [deduplication.get_ngrams(text, 5) for text in texts]
+    hashed = [deduplication.hash_ngrams(ngs) for ngs in sets]
+    for i in range(len(texts)):
+        for j in range(len(texts)):
+            exact = deduplication.jaccard_similarity(sets[i], sets[j])
+            assert deduplication.hashed_jaccard_similarity(hashed[i], hashed[j]) == pytest.approx(exact)
+
+    cache = deduplication.NgramSetCache(max_bytes=hashed[0].nbytes + hashed[1].nbytes)
+    for i, hashes in enumerate(hashed):
+        cache.put(i, hashes)
+    assert cache.num_bytes <= cache.max_bytes
+    assert cache.evictions >= 1
+    assert cache.get(0) is None
+
+    records = list(enumerate(texts))
+    for cache_bytes in [1 << 20, 0]:
+        verified = deduplication.minhash_deduplicate_records(
+            records, 100, 10, 5, 0.8, verify=True, verify_cache_bytes=cache_bytes
+        )
+        assert verified.keep.sum() == len(texts) - 1
+
+
+def test_compact_lsh_matches_dict_lsh():
+    rng = np.random.default_rng(0)
+    signatures = [rng.integers(0, 1 << 62, size=20).tolist() for _ in range(200)]
+    for i in range(0, 200, 7):
+        # share exactly one band with the previous document
+        signatures[i][:4] = signatures[i - 1][:4]
+    signatures[50] = list(signatures[49])
+    # reference: a dict of documents per (band, rows) key
+    buckets = defaultdict(set)
+    compact = deduplication.CompactLSH(5, capacity=16)
+    for i, signature in enumerate(signatures):
+        for band in range(5):
+            buckets[band, tuple(signature[band * 4 : (band + 1) * 4])].add(i)
+        assert compact.insert(signature) == i
+    compact.build()
+    assert compact.doc_ids[0].dtype == np.int32
+    for i, signature in enumerate(signatures):
+        expected = set().union(*(buckets[band, tuple(signature[band * 4 : (band + 1) * 4])] for band in range(5)))
+        assert set(compact.query(i).tolist()) == expected - {i}
+    assert compact.colliding() == set().union(*(docs for docs in buckets.values() if len(docs) > 1))
+
+
+def test_minhash_deduplication_uses_the_callers_writer(tmp_path):
+    input_files = sorted((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))
+    with AsyncWriter(compression="gzip") as writer:
+        survivors = deduplication.minhash_deduplication(input_files, 100, 10, 5, 0.8, tmp_path, writer=writer)
+    for source in survivors:
+        assert gzip.decompress((tmp_path / f"{source.name}.gz").read_bytes()) == source.read_bytes()
+    with pytest.raises(ValueError, match="output_mode='write'"), AsyncWriter() as writer:
+        deduplication.minhash_deduplication(input_files, 100, 10, 5, 0.8, tmp_path, writer=writer, output_mode="copy")
+
+
+def test_minhash_deduplicate_records_plans_hashes_for_fixed_bands():
+    texts = [path.read_text() for path in sorted((FIXTURES_PATH / "documents_with_line_duplicates").glob("doc*.txt"))]
+    records = list(enumerate(texts))
+    planned = deduplication.minhash_deduplicate_records(records, None, 10, 5, 0.8)
+    explicit = deduplication.minhash_deduplicate_records(records, 100, 10, 5, 0.8)
+    assert planned.kept_ids() == explicit.kept_ids()
+    with pytest.raises(ValueError, match="num_bands"):
+        deduplication.minhash_deduplicate_records(records, 8, 10, 5, 0.8)
+
+
+def test_minhash_deduplicate_records_plans_within_error_budgets():
+    texts = [path.read_text() for path in sorted((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))]
+    records = list(enumerate(texts))
+    loose = deduplication.minhash_deduplicate_records(
+        records, None, None, 5, 0.8, sketch="oph", max_false_positive=0.2, max_false_negative=0.2
+    )
+    tight = deduplication.minhash_deduplicate_records(
+        records, None, None, 5, 0.8, sketch="oph", max_false_positive=0.1, max_false_negative=0.1
+    )
+    assert loose.plan == plan_lsh(0.8, max_false_positive=0.2, max_false_negative=0.2)
+    assert tight.plan == plan_lsh(0.8, max_false_positive=0.1, max_false_negative=0.1)
+    # the cheapest split within the looser budget uses fewer hashes
+    assert loose.plan.num_hashes < tight.plan.num_hashes
+    assert tight.plan.false_positive <= 0.1 and tight.plan.false_negative <= 0.1
+    assert tight.keep.sum() == len(records) - 1
+    with pytest.raises(ValueError, match="budgets"):
+        deduplication.minhash_deduplicate_records(records, 100, 10, 5, 0.8, max_false_negative=0.1)
+
+def test_verification_cache_smaller_than_corpus(tmp_path):
+    texts = [path.read_text() for path in sorted((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))]
+    rng = np.random.default_rng(0)
+    vocab = [f"word{i}" for i in range(5000)]
+    # many unique documents without LSH candidates, inserted before the duplicates
+    unique = [" ".join(rng.choice(vocab, size=300)) for _ in range(50)]
+    records = list(enumerate(unique + texts))
+    candidate_bytes = sum(deduplication.hash_ngrams(deduplication.get_ngrams(text, 5)).nbytes for text in texts)
+    corpus_bytes = candidate_bytes + sum(
+        deduplication.hash_ngrams(deduplication.get_ngrams(text, 5)).nbytes for text in unique
+    )
+    assert candidate_bytes < corpus_bytes // 4
+
+    # oph keeps the signatures cheap, verification does not depend on the sketch
+    exact = deduplication.minhash_deduplicate_records(records, 100, 10, 5, 0.8, sketch="oph", verify=True)
+    assert exact.keep.sum() == len(records) - 1
+    # sets that do not fit the cache are read back from the spill file: verification stays exact
+    for cache_bytes in (candidate_bytes, candidate_bytes // 3, 0):
+        bounded = deduplication.minhash_deduplicate_records(
+            records, 100, 10, 5, 0.8, sketch="oph", verify=True, verify_cache_bytes=cache_bytes
+        )
+        assert np.array_equal(bounded.keep, exact.keep)
+
+    # the records are read once, so a generator works and the spill file is removed afterwards
+    streamed = deduplication.minhash_deduplicate_records(
+        (record for record in records), 100, 10, 5, 0.8, sketch="oph", verify=True, spill_dir=tmp_path
+    )
+    assert np.array_equal(streamed.keep, exact.keep)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,27 @@
+import logging
+
+from cs336_data import features
+from cs336_data.deduplication import get_ngrams
+from cs336_data.features import DocumentFeatures
+
+from .adapters import run_gopher_quality_filter
+
+logger = logging.getLogger(__name__)
+
+
+def test_document_features_tokenize_once(monkeypatch):
+    calls = []
+
+    def counting_word_tokenize(text):
+        calls.append(text)
+        return text.split()
+
+    monkeypatch.setattr(features, "word_tokenize", counting_word_tokenize)
+    text = "This should definitely be a valid input text\nand of high quality according to Gopher rules.\n" * 20
+    doc = DocumentFeatures(text)
+    assert run_gopher_quality_filter(doc) == run_gopher_quality_filter(text)
+    assert get_ngrams(doc, 2) == get_ngrams(text, 2)
+    assert doc.single_line == text.replace("\n", " ").strip()
+    assert len(doc.non_empty_lines) == 40
+    # one tokenization for the shared features, one each for the raw-text calls
+    assert len(calls) == 3
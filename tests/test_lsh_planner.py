@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from cs336_data.lsh_planner import candidate_probability, plan_lsh
+
+
+def test_plan_respects_budgets_and_hash_limit():
+    plan = plan_lsh(0.8, num_hashes=100)
+    assert plan.num_hashes <= 100
+    # the S-curve of the chosen split crosses 1/2 near the threshold
+    assert abs(plan.report()["effective_threshold"] - 0.8) < 0.1
+
+    budgeted = plan_lsh(0.8, max_false_positive=0.1, max_false_negative=0.05)
+    assert budgeted.false_positive <= 0.1
+    assert budgeted.false_negative <= 0.05
+    assert budgeted.num_hashes <= plan_lsh(0.8).num_hashes
+
+
+def test_expected_candidate_pairs():
+    plan = plan_lsh(0.5, num_hashes=64)
+    similarities = np.linspace(0, 1, 100_001)
+    uniform = plan.expected_candidate_pairs(1000)
+    assert np.isclose(uniform, plan.expected_candidate_pairs(1000, similarities), rtol=1e-3)
+    assert plan.expected_candidate_pairs(1000, np.zeros(10)) == 0
+    assert np.isclose(candidate_probability(1.0, plan.num_bands, plan.rows_per_band), 1.0)
+
+
+def test_plan_with_fixed_bands():
+    plan = plan_lsh(0.8, num_bands=16)
+    assert plan.num_bands == 16
+    assert plan.num_hashes == 16 * plan.rows_per_band <= 256
+    assert plan_lsh(0.8, num_hashes=64, num_bands=16).rows_per_band <= 4
+    with pytest.raises(ValueError, match="num_bands"):
+        plan_lsh(0.8, num_hashes=8, num_bands=16)
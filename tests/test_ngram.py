@@ -0,0 +1,94 @@
+import logging
+import math
+
+import numpy as np
+
+from cs336_data.ngram import CompactKneserNey
+from cs336_data.train import (
+    batch_log_perplexity,
+    perplexity_of_text,
+    sampled_perplexity_of_text,
+    train_ngram_model_streaming,
+)
+
+logger = logging.getLogger(__name__)
+
+CORPUS = [
+    "the cat sat on the mat".split(),
+    "the dog sat on the log".split(),
+    "a cat and a dog played on the mat".split(),
+]
+
+
+def test_compact_kneser_ney_is_normalized():
+    model = CompactKneserNey.fit(CORPUS, 3)
+    words = ["the", "cat", "dog", "sat", "on", "mat", "log", "a", "and", "played", "</s>", "<s>"]
+    assert model.vocab_size == len(words)
+    for context in [("<s>", "<s>"), ("the", "cat"), ("sat", "on"), ("unseen", "context"), ("on", "zebra")]:
+        # probability mass over the vocabulary plus the unknown token sums to one
+        total = sum(model.score(w, context) for w in words) + model.score("zebra", context)
+        assert np.isclose(total, 1.0)
+    assert model.score("sat", ("the", "cat")) > model.score("log", ("the", "cat"))
+
+
+def test_compact_kneser_ney_save_load(tmp_path):
+    model = CompactKneserNey.fit(CORPUS, 3)
+    model.save(tmp_path / "ngram")
+    loaded = CompactKneserNey.load(tmp_path / "ngram")
+    assert isinstance(loaded.arrays["keys_3"], np.memmap)
+    for word, context in [("mat", ("on", "the")), ("dog", ("<s>", "the")), ("zebra", ("a", "cat"))]:
+        assert loaded.score(word, context) == model.score(word, context)
+
+
+def test_batch_log_perplexity_matches_per_ngram_scoring():
+    model = CompactKneserNey.fit(CORPUS, 3)
+    docs = [["the", "cat", "sat"], [], ["a", "zebra", "on", "the", "mat", "today"]]
+    log_ppl, token_logprobs = batch_log_perplexity(model, docs, return_token_logprobs=True)
+    for tokens, doc_log_ppl, doc_logprobs in zip(docs, log_ppl, token_logprobs):
+        padded = ["<s>", "<s>"] + tokens + ["</s>", "</s>"]
+        expected = [math.log(model.score(padded[i], padded[i - 2 : i])) for i in range(2, len(padded))]
+        assert np.allclose(doc_logprobs, expected)
+        assert np.isclose(doc_log_ppl, -sum(expected) / len(expected))
+        assert np.isclose(perplexity_of_text(model, tokens, 3), math.exp(doc_log_ppl))
+
+
+def test_streaming_training_matches_in_memory_training(tmp_path):
+    corpus_dir = tmp_path / "wiki"
+    corpus_dir.mkdir()
+    for i, tokens in enumerate(CORPUS * 3):
+        (corpus_dir / f"doc{i}.txt").write_text(" ".join(tokens))
+    (corpus_dir / "ignored.json").write_text("{}")
+    model = CompactKneserNey.fit(CORPUS * 3, 3)
+    streamed = train_ngram_model_streaming(
+        corpus_dir, 3, tokenizer=str.split, num_workers=2, files_per_task=2, max_rows_in_memory=8, spill_dir=tmp_path
+    )
+    for name, array in model.arrays.items():
+        assert np.array_equal(streamed.arrays[name], array)
+
+
+def test_sampled_perplexity_stops_early_and_is_reproducible():
+    model = CompactKneserNey.fit(CORPUS * 5, 3)
+    text = " ".join(["The cat sat on the mat.", "The dog sat on the log."] * 50)
+    in_domain = sampled_perplexity_of_text(model, text.lower(), str.split, threshold=1000, seed=1)
+    assert in_domain["decided"]
+    assert in_domain["perplexity"] < 1000
+    assert in_domain["num_sentences"] < in_domain["total_sentences"] == 100
+    assert sampled_perplexity_of_text(model, text.lower(), str.split, threshold=1000, seed=1) == in_domain
+
+    exhaustive = sampled_perplexity_of_text(model, text.lower(), str.split, threshold=1000, min_sentences=100)
+    assert exhaustive["num_sentences"] == 100
+    assert exhaustive["decided"]
+
+
+def test_sampled_perplexity_reports_forced_decisions():
+    model = CompactKneserNey.fit(CORPUS * 5, 3)
+    text = " ".join(["The cat sat on the mat.", "The dog sat on the log."] * 50).lower()
+    # the sample runs out (max_sentences) before the interval can clear a threshold at the estimate
+    estimate = sampled_perplexity_of_text(model, text, str.split, threshold=1000, seed=1)["perplexity"]
+    forced = sampled_perplexity_of_text(model, text, str.split, threshold=estimate, max_sentences=4)
+    # total_sentences is the document, not the capped sample
+    assert (forced["num_sentences"], forced["total_sentences"]) == (4, 100)
+    assert not forced["decided"]
+    # too few sentences for min_sentences
+    short = sampled_perplexity_of_text(model, "the cat sat on the mat. the dog sat.", str.split, 1000, max_sentences=1)
+    assert not short["decided"]
@@ -1,6 +1,9 @@
 import logging
+import re
 
-from .adapters import run_mask_emails, run_mask_ips, run_mask_phone_numbers
+from cs336_data import masker
+
+from .adapters import run_mask_emails, run_mask_ips, run_mask_phone_numbers, run_mask_pii_batch
 
 logger = logging.getLogger(__name__)
 
@@ -57,3 +60,115 @@ def test_mask_ips():
     masked_text, num_masked = run_mask_ips(test_string)
     assert masked_text == expected_masked_text
     assert num_masked == 1
+
+
+def test_mask_all_single_pass_matches_sequential_masking_without_overlaps():
+    # no two candidates of different kinds overlap here, see the next test for when they do
+    test_string = (
+        "Contact pl@fakedomain.ai or spl@fakedomain.ai, call (283) 182-3829 or 2831823829. "
+        "The server is at 192.0.2.146 and the backup at 283.182.3829, "
+        "|||EMAIL_ADDRESS||| was already masked."
+    )
+    result = masker.mask_all(test_string)
+    assert result == masker.mask_all_sequential(test_string)
+    assert (result["num_emails"], result["num_phone_numbers"], result["num_ips"]) == (2, 3, 1)
+
+
+def test_mask_all_resolves_overlapping_candidates_leftmost_first():
+    # the phone pattern matches from "123", before the card number starts
+    test_string = "order 123 456 4111 1111 1111 1111 shipped"
+    result = masker.mask_all(test_string)
+    assert result["text"] == "order |||PHONE_NUMBER||| 1111 1111 1111 shipped"
+    assert (result["num_phone_numbers"], result["num_credit_cards"]) == (1, 0)
+    # sequentially the higher priority card detector claims its match first
+    sequential = masker.mask_all_sequential(test_string)
+    assert sequential["text"] == "order 123 456 |||CREDIT_CARD_NUMBER||| shipped"
+    assert (sequential["num_phone_numbers"], sequential["num_credit_cards"]) == (0, 1)
+
+def test_mask_all_prefilter_skips_absent_patterns():
+    stats = masker.PrefilterStats()
+    documents = [
+        "No personal information here at all.",
+        "Write to pl@fakedomain.ai for details.",
+        "Call 283-182-3829 or visit 192.0.2.146.",
+    ]
+    for document in documents:
+        assert masker.mask_all(document, stats=stats) == masker.mask_all(document, prefilter=False)
+    assert stats.num_docs == 3
+    skip_rates = stats.skip_rates()
+    assert (skip_rates["email"], skip_rates["phone"], skip_rates["ip"]) == (2 / 3, 2 / 3, 2 / 3)
+
+
+def test_mask_pii_batch_spans():
+    texts = [
+        "Feel free to contact me at test@gmail.com if you have any questions.",
+        "You can access the server at 192.0.2.146.",
+        "Nothing to see here.",
+    ] * 50
+    masked = run_mask_pii_batch(texts, num_workers=2)
+    assert masked == [masker.mask_all(text) for text in texts]
+    spans = run_mask_pii_batch(texts, num_workers=2, return_spans=True)
+    assert spans[0]["spans"] == [(27, 41, "email")]
+    assert spans[1]["spans"] == [(29, 40, "ip")]
+    assert spans[2]["spans"] == [] and spans[2]["num_emails"] == spans[2]["num_ips"] == 0
+    for text, result, span_result in zip(texts, masked, spans):
+        assert masker.apply_spans(text, span_result["spans"]) == result["text"]
+
+
+def test_mask_all_validated_detectors():
+    test_string = (
+        "Card 4111 1111 1111 1111 but not 4111 1111 1111 1112, SSN 123-45-6789 but not 666-45-6789, "
+        "IP 10.0.0.1 but not 999.1.1.1, IPv6 2001:db8::1 but not 12:30:45."
+    )
+    result = masker.mask_all(test_string)
+    assert result["text"] == (
+        "Card |||CREDIT_CARD_NUMBER||| but not 4111 1111 1111 1112, SSN |||SSN||| but not 666-45-6789, "
+        "IP |||IP_ADDRESS||| but not 999.1.1.1, IPv6 |||IP_ADDRESS||| but not 12:30:45."
+    )
+    assert (result["num_credit_cards"], result["num_ssns"], result["num_ips"], result["num_ipv6s"]) == (1, 1, 1, 1)
+    # a rejected candidate does not hide lower priority detectors inside it
+    masked_text, num_masked = run_mask_phone_numbers("Call 283 182 3829 1234.")
+    assert masker.mask_all("Call 283 182 3829 1234.")["text"] == masked_text == "Call |||PHONE_NUMBER||| 1234."
+    # nor one that starts inside it and runs past its end: the scan restarts right after its start
+    text = "Card 1111 2222 3333 4444 555 1234, call back."
+    result = masker.mask_all(text)
+    assert result["text"] == run_mask_phone_numbers(text)[0] == "Card 1111 2222 3333 4|||PHONE_NUMBER|||, call back."
+    assert (result["num_credit_cards"], result["num_phone_numbers"]) == (0, 1)
+    assert result == masker.mask_all_sequential(text)
+
+
+def test_register_detector():
+    detector = masker.Detector("student_id", re.compile(r"\bSUID\d{6}\b"), "|||STUDENT_ID|||", "num_student_ids")
+    masker.register_detector(detector, before="email")
+    try:
+        assert list(masker.DETECTORS)[0] == "student_id"
+        result = masker.mask_all("SUID123456 wrote to test@gmail.com")
+        assert result["text"] == "|||STUDENT_ID||| wrote to |||EMAIL_ADDRESS|||"
+        assert result["num_student_ids"] == 1
+    finally:
+        masker.unregister_detector("student_id")
+    assert "num_student_ids" not in masker.mask_all("SUID123456")
+
+
+def test_mask_credit_cards_requires_card_shape():
+    text = "Visa 4111-1111-1111-1111, Amex 3782 822463 10005, plain 5500000000000004."
+    assert masker.mask_kind(text, "credit_card") == (
+        "Visa |||CREDIT_CARD_NUMBER|||, Amex |||CREDIT_CARD_NUMBER|||, plain |||CREDIT_CARD_NUMBER|||.",
+        3,
+    )
+    # these pass the Luhn check but are lists of years or numbers, not cards
+    negatives = [
+        "Seasons 1900 1901 1902 1903 were played.",
+        "Ranks: 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 2",
+        "Codes 12 34 56 78 90 12 34 11 and 4111 1111-1111 1111",
+    ]
+    for text in negatives:
+        assert masker.mask_kind(text, "credit_card") == (text, 0)
+        assert masker.mask_all(text)["num_credit_cards"] == 0
+
+
+def test_ipv6_prefilter_needs_hex_colons():
+    stats = masker.PrefilterStats()
+    masker.mask_all("Meeting at 12: agenda: none", stats=stats)
+    masker.mask_all("Host fe80::1 and 2001:db8::1", stats=stats)
+    assert stats.skip_rates()["ipv6"] == 0.5
@@ -0,0 +1,35 @@
+import json
+
+from cs336_data.deduplication import exact_line_deduplication
+from cs336_data.profiling import PipelineStats
+
+
+def test_pipeline_stats_counts_docs_and_bytes(tmp_path):
+    stats = PipelineStats(log_interval=None)
+    items = list(stats.iterate("extract", ["ab", "cde", "f"], nbytes=len))
+    for item in items:
+        with stats.stage("filter", len(item)) as stage:
+            stage.passed = len(item) > 1
+    summary = stats.summary()["stages"]
+    assert summary["extract"]["docs_in"] == summary["extract"]["docs_out"] == 3
+    assert summary["extract"]["bytes_in"] == 6
+    assert summary["filter"]["docs_in"] == 3
+    assert summary["filter"]["docs_out"] == 2
+    assert abs(summary["filter"]["pass_rate"] - 2 / 3) < 1e-9
+
+    stats.write_json(tmp_path / "stats.json")
+    assert json.loads((tmp_path / "stats.json").read_text())["stages"].keys() == {"extract", "filter"}
+
+
+def test_exact_line_deduplication_records_stages(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text(f"shared\nunique {i}\n")
+        paths.append(path)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    stats = PipelineStats(log_interval=None)
+    exact_line_deduplication(paths, out_dir, stats=stats)
+    assert stats.stages["count_lines"].docs_in == stats.stages["rewrite"].docs_in == 2
+    assert (out_dir / "doc0.txt").read_text() == "unique 0\n"
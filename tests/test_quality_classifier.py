@@ -0,0 +1,59 @@
+import itertools
+import logging
+
+import numpy as np
+
+from cs336_data import quality_classifier
+
+logger = logging.getLogger(__name__)
+
+
+def test_fit_platt_scaling_recovers_miscalibrated_scores():
+    rng = np.random.default_rng(0)
+    true_p = rng.uniform(0.05, 0.95, size=5000)
+    targets = rng.uniform(size=5000) < true_p
+    # an overconfident classifier: logits are twice as large as they should be
+    overconfident = 1 / (1 + np.exp(-2 * np.log(true_p / (1 - true_p))))
+    a, b = quality_classifier.fit_platt_scaling(overconfident, targets)
+    assert abs(a - 0.5) < 0.1
+    assert abs(b) < 0.1
+
+
+def test_quality_classifier_round_trip(tmp_path):
+    wiki = [
+        f"The treaty of {i} established the boundaries of the province and was ratified by the assembly."
+        for i in range(200)
+    ]
+    cc = [f"click here buy now cheap deals free shipping best price offer {i} !!!" for i in range(200)]
+    train_path, valid_path = tmp_path / "quality.train", tmp_path / "quality.valid"
+    counts = quality_classifier.build_training_files(
+        train_path, valid_path, positives=wiki + wiki[:10], negatives=cc, valid_fraction=0.2
+    )
+    # exact duplicates are dropped
+    assert counts == {"wiki": 200, "cc": 200}
+    model_path = tmp_path / "quality.bin"
+    metrics = quality_classifier.train_quality_classifier(train_path, valid_path, model_path, epoch=25, min_count=1)
+    assert metrics["accuracy"] > 0.9
+    assert (tmp_path / "quality.calibration.json").exists()
+
+    predictions = quality_classifier.quality_classification_batch(
+        ["The assembly ratified the treaty of the province.", "cheap deals free shipping click here"], model_path
+    )
+    assert [label for label, _ in predictions] == ["wiki", "cc"]
+    assert all(isinstance(score, float) and 0.5 <= score <= 1 for _, score in predictions)
+
+
+def test_build_training_files_stops_reading_full_labels(tmp_path):
+    pulled = {"wiki": 0, "cc": 0}
+
+    def source(label):
+        # endless, so the call only returns if full labels stop being read
+        for i in itertools.count():
+            pulled[label] += 1
+            yield f"{label} document number {i} with enough words"
+
+    counts = quality_classifier.build_training_files(
+        tmp_path / "train", tmp_path / "valid", positives=source("wiki"), negatives=source("cc"), max_docs_per_label=5
+    )
+    assert counts == {"wiki": 5, "cc": 5}
+    assert pulled == {"wiki": 5, "cc": 5}
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from cs336_data import deduplication
+from cs336_data.sketches import EMPTY, b_bit_signature, estimate_jaccard, one_permutation_signature
+
+from .common import FIXTURES_PATH
+
+
+def test_one_permutation_signature_densifies_and_estimates_jaccard():
+    rng = np.random.default_rng(0)
+    universe = rng.integers(0, 1 << 63, size=4000).astype(np.uint64)
+    a, b = np.unique(universe[:3000]), np.unique(universe[1000:])
+    exact = 2000 / 4000
+    sig_a, sig_b = one_permutation_signature(a, 256), one_permutation_signature(b, 256)
+    assert abs(estimate_jaccard(sig_a, sig_b) - exact) < 0.1
+
+    # a short set leaves bins empty; densification fills them identically for equal sets
+    short = one_permutation_signature(a[:10], 256)
+    assert not (short == EMPTY).any()
+    assert np.array_equal(short, one_permutation_signature(a[:10].copy(), 256))
+    assert (one_permutation_signature(a[:0], 16) == EMPTY).all()
+
+
+@pytest.mark.parametrize("bits", [8, 16, 32])
+def test_b_bit_signatures(bits):
+    rng = np.random.default_rng(1)
+    sig_a = rng.integers(0, 1 << 63, size=512).astype(np.uint64)
+    sig_b = sig_a.copy()
+    sig_b[:256] = rng.integers(0, 1 << 63, size=256).astype(np.uint64)
+    small_a, small_b = b_bit_signature(sig_a, bits), b_bit_signature(sig_b, bits)
+    assert small_a.itemsize * 8 == bits
+    # 256 of 512 slots agree; the chance agreement of the other half is corrected for
+    assert abs(estimate_jaccard(small_a, small_b, bits) - 0.5) < 0.05
+
+
+@pytest.mark.parametrize("bits", [None, 16, 8])
+def test_minhash_deduplication_with_oph_sketch(tmp_path, bits):
+    input_files = list((FIXTURES_PATH / "documents_with_fuzzy_duplicates").glob("*.txt"))
+    survivors = deduplication.minhash_deduplication(input_files, 128, 16, 5, 0.8, tmp_path, sketch="oph", bits=bits)
+    assert len(survivors) == len(input_files) - 1
@@ -0,0 +1,48 @@
+import gzip
+
+import pytest
+
+from cs336_data import writer as writer_module
+from cs336_data.writer import AsyncWriter
+
+
+@pytest.mark.parametrize("fsync_every", [0, 3])
+def test_async_writer_files_and_streams(tmp_path, fsync_every):
+    with AsyncWriter(max_pending=2, fsync_every=fsync_every) as writer:
+        for i in range(10):
+            writer.write_file(tmp_path / f"doc_{i}.txt", f"document {i}\n")
+            writer.append(tmp_path / "shard.jsonl", f'{{"id": {i}}}\n')
+    assert writer.num_files == 10
+    assert (tmp_path / "doc_7.txt").read_text() == "document 7\n"
+    assert (tmp_path / "shard.jsonl").read_text().splitlines()[-1] == '{"id": 9}'
+
+
+def test_async_writer_gzip(tmp_path):
+    with AsyncWriter(compression="gzip", fsync_every=2) as writer:
+        path = writer.write_file(tmp_path / "doc.txt", "compressed text")
+        writer.append(tmp_path / "shard.jsonl", b"a\n")
+        writer.append(tmp_path / "shard.jsonl", b"b\n")
+    assert path == str(tmp_path / "doc.txt.gz")
+    assert gzip.decompress((tmp_path / "doc.txt.gz").read_bytes()) == b"compressed text"
+    assert gzip.decompress((tmp_path / "shard.jsonl.gz").read_bytes()) == b"a\nb\n"
+
+
+def test_async_writer_surfaces_errors(tmp_path):
+    writer = AsyncWriter()
+    writer.write_file(tmp_path / "missing_dir" / "doc.txt", "text")
+    with pytest.raises(FileNotFoundError):
+        writer.close()
+
+
+def test_async_writer_zstd_without_zstandard(monkeypatch):
+    monkeypatch.setattr(writer_module, "zstandard", None)
+    with pytest.raises(ImportError, match=r"cs336-data\[zstd\]"):
+        AsyncWriter(compression="zstd")
+
+
+def test_async_writer_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    with AsyncWriter(compression="zstd") as writer:
+        writer.write_file(tmp_path / "doc.txt", "zstd document\n")
+    with zstandard.open(tmp_path / "doc.txt.zst", "rt") as f:
+        assert f.read() == "zstd document\n"